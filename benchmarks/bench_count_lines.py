@@ -0,0 +1,35 @@
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from codebase_analyzer import CodebaseAnalyzer
+
+
+def count_lines_readlines(file_path):
+    # 旧实现：解码整个文件并构建行列表
+    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+        return len(f.readlines())
+
+
+def main():
+    analyzer = CodebaseAnalyzer({})
+    line = "    result = compute_something(alpha, beta, gamma)  # 注释\n"
+
+    with tempfile.TemporaryDirectory() as directory:
+        for lines in [50, 600, 20000]:
+            file_path = os.path.join(directory, f"sample_{lines}.py")
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write(line * lines)
+
+            assert analyzer._count_lines(file_path) == count_lines_readlines(file_path)
+            number = max(10, 200000 // lines)
+            old = timeit.timeit(lambda: count_lines_readlines(file_path), number=number) / number
+            new = timeit.timeit(lambda: analyzer._count_lines(file_path), number=number) / number
+            print(f"{lines:>6} 行: readlines {old * 1e6:9.1f} us, 字节计数 {new * 1e6:9.1f} us, 加速 {old / new:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from planner import MAX_POOL_SIZE, build_commit_plan
+
+
+def make_refactor_plan(pairs):
+    refactor_plan = []
+    for i in range(pairs):
+        file_path = f"src/file_{i}.py"
+        refactor_plan.append({"file_path": file_path, "new_content": f"modified {i}\n", "commit_message": f"Add {i}"})
+        refactor_plan.append({"file_path": file_path, "new_content": f"original {i}\n", "commit_message": f"Remove {i}"})
+    return refactor_plan
+
+
+def check_plan(final_plan, refactor_plan, times):
+    # 每个提交都要有净改动，所有文件最终恢复原样
+    assert len(final_plan) == times
+    originals = {p["file_path"]: p["new_content"] for p in refactor_plan[1::2]}
+    state = dict(originals)
+    for commit in final_plan:
+        before = dict(state)
+        for change in commit:
+            state[change["file_path"]] = change["new_content"]
+        assert state != before
+    assert state == originals
+
+
+def main():
+    for pairs in [1, 2, 7, MAX_POOL_SIZE]:
+        for times in [2, 3, 10, 11, 100, 1000, 10000]:
+            if pairs < 2 < times:
+                continue
+            refactor_plan = make_refactor_plan(pairs)
+            started = time.perf_counter()
+            final_plan = build_commit_plan(refactor_plan, times)
+            elapsed = time.perf_counter() - started
+            check_plan(final_plan, refactor_plan, times)
+            if times == 10000:
+                print(f"{pairs:>3} 对修改, {times} 个提交: {elapsed * 1e3:7.2f} ms")
+                assert elapsed < 1.0
+
+
+if __name__ == "__main__":
+    main()
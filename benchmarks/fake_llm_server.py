@@ -0,0 +1,192 @@
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 从提示词中取出原始代码，格式见 LLMRefactorer._original_block 和 _plan_batch
+ORIGINAL_CODE = re.compile(r"原始代码:\n        ```\n        (.*?)\n        ```\n", re.S)
+FILE_PATH = re.compile(r"文件路径: (.*)")
+ADDITION = "benchmark_marker = 1\n"
+
+
+def _added(content):
+    # 在末尾换行之前加入一行，保持文件末尾的换行不变
+    stripped = content.rstrip("\n")
+    return stripped + "\n" + ADDITION.rstrip("\n") + content[len(stripped):]
+
+
+def _edits(content):
+    for line in content.splitlines(keepends=True):
+        if len(line.strip()) > 0 and content.count(line) == 1:
+            return [{"search": line, "replace": line + ADDITION}]
+    return [{"search": content, "replace": _added(content)}]
+
+
+def respond(prompt):
+    # 按提示词中要求的 JSON 字段生成合法的响应
+    originals = ORIGINAL_CODE.findall(prompt)
+    if '"selected_files"' in prompt:
+        count = int(re.search(r"需要选择的文件数量: (\d+)", prompt).group(1))
+        paths = re.findall(r'"path": "(.*?)"', prompt)[:count]
+        result = {"selected_files": [
+            {"file_path": path, "reason": "benchmark", "modification_strategy": "add a helper",
+             "operations": ["add_function"]} for path in paths
+        ]}
+    elif '"commit_messages"' in prompt:
+        result = {"commit_messages": ["Update helper"] * prompt.count('"file_path"')}
+    elif '"results"' in prompt:
+        paths = FILE_PATH.findall(prompt)
+        if "删除刚才添加" in prompt:
+            result = {"results": [{"file_path": path, "modified_code": content, "commit_message": "Update helper"}
+                                  for path, content in zip(paths, originals)]}
+        elif '"edits"' in prompt:
+            result = {"results": [{"file_path": path, "edits": _edits(content), "commit_message": "Add helper"}
+                                  for path, content in zip(paths, originals)]}
+        else:
+            result = {"results": [{"file_path": path, "modified_code": _added(content), "commit_message": "Add helper"}
+                                  for path, content in zip(paths, originals)]}
+    elif "删除刚才添加" in prompt:
+        result = {"modified_code": originals[0], "commit_message": "Update helper"}
+    elif '"edits"' in prompt:
+        result = {"edits": _edits(originals[0]), "commit_message": "Add helper"}
+    else:
+        result = {"modified_code": _added(originals[0]), "commit_message": "Add helper"}
+    return json.dumps(result, ensure_ascii=False)
+
+
+def _message_text(message):
+    content = message.get("content", "")
+    if isinstance(content, list):
+        return "".join(block.get("text", "") for block in content)
+    return content
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.5
+    tokens_per_second = 100.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))))
+        prompt = _message_text(body["messages"][0])
+        text = respond(prompt)
+        input_tokens = len(prompt) // 4 + 1
+        output_tokens = len(text) // 4 + 1
+
+        if self.path.endswith("/chat/completions"):
+            handler = self._openai_stream if body.get("stream") else self._openai
+        elif self.path.endswith("/messages"):
+            handler = self._anthropic_stream if body.get("stream") else self._anthropic
+        else:
+            self.send_error(404)
+            return
+        time.sleep(self.latency)
+        try:
+            handler(body, text, input_tokens, output_tokens)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端因格式不符提前关闭了流式连接，直接结束这个请求
+            self.close_connection = True
+
+    def _send_json(self, data):
+        payload = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _start_events(self):
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.send_header("connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+    def _event(self, data, event=None):
+        line = f"data: {data if isinstance(data, str) else json.dumps(data)}\n\n"
+        if event is not None:
+            line = f"event: {event}\n" + line
+        self.wfile.write(line.encode("utf-8"))
+        self.wfile.flush()
+
+    def _chunks(self, text):
+        # 每块约 4 个 token，按 tokens_per_second 的速度输出
+        size = 16
+        for start in range(0, len(text), size):
+            time.sleep(4 / self.tokens_per_second)
+            yield text[start:start + size]
+
+    def _openai(self, body, text, input_tokens, output_tokens):
+        time.sleep(output_tokens / self.tokens_per_second)
+        self._send_json({
+            "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": input_tokens, "completion_tokens": output_tokens,
+                      "total_tokens": input_tokens + output_tokens},
+        })
+
+    def _openai_stream(self, body, text, input_tokens, output_tokens):
+        self._start_events()
+        chunk = {"id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion.chunk",
+                 "created": int(time.time()), "model": body["model"]}
+        for part in self._chunks(text):
+            self._event({**chunk, "choices": [{"index": 0, "delta": {"content": part}, "finish_reason": None}]})
+        self._event({**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        self._event({**chunk, "choices": [], "usage": {"prompt_tokens": input_tokens, "completion_tokens": output_tokens,
+                                                       "total_tokens": input_tokens + output_tokens}})
+        self._event("[DONE]")
+
+    def _anthropic(self, body, text, input_tokens, output_tokens):
+        time.sleep(output_tokens / self.tokens_per_second)
+        self._send_json({
+            "id": f"msg_{uuid.uuid4().hex}", "type": "message", "role": "assistant", "model": body["model"],
+            "content": [{"type": "text", "text": text}], "stop_reason": "end_turn", "stop_sequence": None,
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens},
+        })
+
+    def _anthropic_stream(self, body, text, input_tokens, output_tokens):
+        self._start_events()
+        self._event({"type": "message_start", "message": {
+            "id": f"msg_{uuid.uuid4().hex}", "type": "message", "role": "assistant", "model": body["model"],
+            "content": [], "stop_reason": None, "stop_sequence": None,
+            "usage": {"input_tokens": input_tokens, "output_tokens": 1},
+        }}, "message_start")
+        self._event({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+                    "content_block_start")
+        for part in self._chunks(text):
+            self._event({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": part}},
+                        "content_block_delta")
+        self._event({"type": "content_block_stop", "index": 0}, "content_block_stop")
+        self._event({"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                     "usage": {"output_tokens": output_tokens}}, "message_delta")
+        self._event({"type": "message_stop"}, "message_stop")
+
+
+def start_server(latency=0.5, tokens_per_second=100.0, port=0):
+    # 在后台线程中启动，返回 (server, base_url)；OpenAI 客户端需要在 base_url 后加 /v1
+    handler = type("Handler", (FakeLLMHandler,), {"latency": latency, "tokens_per_second": tokens_per_second})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI/Anthropic compatible server for benchmarks.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds before the first token.")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    args = parser.parse_args()
+    server, base_url = start_server(args.latency, args.tokens_per_second, args.port)
+    print(f"Anthropic: -b {base_url}  OpenAI: -b {base_url}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
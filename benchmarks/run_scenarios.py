@@ -0,0 +1,121 @@
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from call_llm import get_call_stats
+from codebase_analyzer import CodebaseAnalyzer
+from commit_mirage import CommitMirage
+from fake_llm_server import start_server
+from main import build_opts, build_parser
+from synthetic_repo import generate_repo
+
+
+def measure(function):
+    # 返回 (结果, 耗时秒数, 内存峰值字节数)
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            result = function()
+        return result, time.perf_counter() - started, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def scenario_analyze(repo):
+    analyzer = CodebaseAnalyzer({})
+    summary, wall, peak = measure(lambda: analyzer.analyze_repository(Path(repo)))
+    return {
+        "wall": wall,
+        "files": summary["total_files"],
+        "files_per_second": summary["total_files"] / wall,
+        "peak_memory": peak,
+    }
+
+
+def scenario_plan(repo, argv):
+    # 只生成计划：分析、选择和 LLM 生成阶段
+    calls = len(get_call_stats())
+    generator = CommitMirage(build_opts(build_parser().parse_args(argv + ["--plan-only", repo])))
+    _, wall, peak = measure(generator.run)
+    plan = os.path.join(repo, ".git", "commit-mirage", "run.json")
+    stats = get_call_stats()[calls:]
+    output_tokens = sum(stat["output_tokens"] for stat in stats)
+    return plan, {
+        "wall": wall,
+        "timings": generator.timings,
+        "llm_calls": len(stats),
+        "input_tokens": sum(stat["input_tokens"] for stat in stats),
+        "output_tokens": output_tokens,
+        "output_tokens_per_second": output_tokens / generator.timings["plan"] if generator.timings["plan"] else 0,
+        "peak_memory": peak,
+    }
+
+
+def scenario_commit(repo, argv, plan, backend, times):
+    # 离线应用同一份计划，只测量提交阶段，结束后恢复仓库
+    head = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=repo, encoding="utf-8").strip()
+    generator = CommitMirage(build_opts(build_parser().parse_args(argv + ["--backend", backend, "--apply", plan,
+                                                                          repo])))
+    _, wall, peak = measure(generator.run)
+    subprocess.check_call(["git", "reset", "-q", "--hard", head], cwd=repo)
+    return {
+        "wall": wall,
+        "commits_per_second": times / generator.timings["commit"],
+        "timings": generator.timings,
+        "peak_memory": peak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark scenarios for Commit Mirage.")
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--languages", default="py=5,js=3,java=1,c=1")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--vendored", type=int, default=2)
+    parser.add_argument("--history", type=int, default=50)
+    parser.add_argument("--times", type=int, default=20)
+    parser.add_argument("--provider", choices=["anthropic", "openai"], default="openai")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake LLM latency before the first token.")
+    parser.add_argument("--tokens-per-second", type=float, default=2000.0)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout.")
+    args, extra_argv = parser.parse_known_args()
+
+    server, base_url = start_server(args.latency, args.tokens_per_second)
+    if args.provider == "openai":
+        base_url += "/v1"
+    argv = ["-p", args.provider, "-b", base_url, "-a", "benchmark", "-t", str(args.times)] + extra_argv
+
+    report = {"config": vars(args), "extra_args": extra_argv, "scenarios": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        repo = os.path.join(directory, "repo")
+        _, wall, _ = measure(lambda: generate_repo(repo, args.files, args.languages, args.depth, args.vendored,
+                                                   history=args.history))
+        report["scenarios"]["generate"] = {"wall": wall}
+        report["scenarios"]["analyze"] = scenario_analyze(repo)
+        plan_path = os.path.join(directory, "plan.json")
+        plan, report["scenarios"]["plan"] = scenario_plan(repo, argv)
+        os.replace(plan, plan_path)
+        for backend in ("worktree", "fast-import"):
+            report["scenarios"][f"commit-{backend}"] = scenario_commit(repo, argv, plan_path, backend, args.times)
+    server.shutdown()
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import os
+import random
+import subprocess
+import time
+
+# 每种语言的函数模板，{i} 为函数序号
+TEMPLATES = {
+    "py": ("", "def function_{i}(value):\n    result = value * {i}\n    if result > 100:\n        return result - 1\n"
+               "    return result\n\n\n", ""),
+    "js": ("", "function function{i}(value) {{\n    const result = value * {i};\n    if (result > 100) {{\n"
+               "        return result - 1;\n    }}\n    return result;\n}}\n\n", ""),
+    "ts": ("", "export function function{i}(value: number): number {{\n    const result = value * {i};\n"
+               "    if (result > 100) {{\n        return result - 1;\n    }}\n    return result;\n}}\n\n", ""),
+    "java": ("public class Generated {\n\n", "    public int function{i}(int value) {{\n        int result = value * {i};\n"
+                                             "        if (result > 100) {{\n            return result - 1;\n        }}\n"
+                                             "        return result;\n    }}\n\n", "}\n"),
+    "c": ("#include <stdio.h>\n\n", "int function_{i}(int value) {{\n    int result = value * {i};\n"
+                                    "    if (result > 100) {{\n        return result - 1;\n    }}\n    return result;\n}}\n\n", ""),
+    "cpp": ("#include <vector>\n\n", "int function_{i}(int value) {{\n    std::vector<int> items(value);\n"
+                                     "    if (items.size() > 100) {{\n        return {i};\n    }}\n"
+                                     "    return static_cast<int>(items.size());\n}}\n\n", ""),
+}
+VENDORED_DIRECTORIES = ["node_modules", "vendor", "third_party"]
+
+
+def parse_languages(text):
+    # "py=5,js=3" 表示按 5:3 的比例生成 Python 和 JavaScript 文件
+    weights = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if name not in TEMPLATES:
+            raise ValueError(f"不支持的语言: {name}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def render_file(language, functions):
+    header, body, footer = TEMPLATES[language]
+    return header + "".join(body.format(i=i) for i in range(functions)) + footer
+
+
+def _random_path(rng, language, index, depth):
+    parts = [f"pkg{rng.randrange(4)}" for _ in range(rng.randint(0, depth))]
+    return "/".join(["src"] + parts + [f"module_{index}.{language}"])
+
+
+def _blob(data):
+    data = data.encode("utf-8")
+    return b"data %d\n" % len(data) + data + b"\n"
+
+
+def generate_repo(path, files=200, languages="py=5,js=3,java=1,c=1", depth=3, vendored=1, vendored_files=50,
+                  history=10, functions=(4, 60), seed=0):
+    rng = random.Random(seed)
+    weights = parse_languages(languages)
+    names = list(weights)
+
+    contents = {}
+    for index in range(files):
+        language = rng.choices(names, [weights[name] for name in names])[0]
+        contents[_random_path(rng, language, index, depth)] = (language, rng.randint(*functions))
+    for directory in VENDORED_DIRECTORIES[:vendored]:
+        for index in range(vendored_files):
+            contents[f"{directory}/lib_{index}/index.js"] = ("js", rng.randint(*functions))
+
+    # 通过 fast-import 一次写入整段历史：第一个提交包含所有文件，之后每个提交修改一个随机文件
+    os.makedirs(path, exist_ok=True)
+    subprocess.check_call(["git", "init", "-q", "-b", "main", path])
+    stream = []
+    now = int(time.time()) - (history + 1) * 3600
+    paths = sorted(contents)
+    for number in range(history + 1):
+        stream.append(b"commit refs/heads/main\n")
+        stream.append(f"committer Bench <bench@example.com> {now + number * 3600} +0000\n".encode("utf-8"))
+        stream.append(_blob(f"Commit {number}"))
+        if number == 0:
+            changed = paths
+        else:
+            changed = [rng.choice(paths)]
+            language, count = contents[changed[0]]
+            contents[changed[0]] = (language, count + 1)
+        for file_path in changed:
+            stream.append(f"M 100644 inline {file_path}\n".encode("utf-8"))
+            stream.append(_blob(render_file(*contents[file_path])))
+        stream.append(b"\n")
+    subprocess.run(["git", "fast-import", "--quiet"], input=b"".join(stream), cwd=path, check=True)
+    subprocess.check_call(["git", "checkout", "-q", "-f", "main"], cwd=path)
+    subprocess.check_call(["git", "config", "user.name", "Bench"], cwd=path)
+    subprocess.check_call(["git", "config", "user.email", "bench@example.com"], cwd=path)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic repository for benchmarks.")
+    parser.add_argument("path")
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--languages", default="py=5,js=3,java=1,c=1", help="Language weights, e.g. py=5,js=3.")
+    parser.add_argument("--depth", type=int, default=3, help="Maximum directory nesting depth.")
+    parser.add_argument("--vendored", type=int, default=1, help="Number of vendored directories (max 3).")
+    parser.add_argument("--vendored-files", type=int, default=50)
+    parser.add_argument("--history", type=int, default=10, help="Commits after the initial one.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate_repo(args.path, args.files, args.languages, args.depth, args.vendored, args.vendored_files,
+                  args.history, seed=args.seed)
+    print(args.path)
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+from typing import Dict, Any, Optional
+
+from utils import print_err
+
+CACHE_VERSION = 1
+
+
+class AnalysisCache:
+    # 以 git blob SHA 为键的持久化分析结果缓存，内容不变的文件无需重新读取
+    def __init__(self, path: str, fingerprint: str):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.entries = {}
+        self.seen = set()
+        self._load()
+
+    def _checksum(self, entries: Dict[str, Any]) -> str:
+        return hashlib.sha256(json.dumps(entries, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print_err(f"分析缓存已损坏，重新构建: {e}")
+            return
+
+        if not isinstance(data, dict) or data.get("version") != CACHE_VERSION \
+                or data.get("fingerprint") != self.fingerprint:
+            print_err("分析缓存已过期，重新构建")
+            return
+
+        entries = data.get("entries")
+        if not isinstance(entries, dict) or data.get("checksum") != self._checksum(entries):
+            print_err("分析缓存校验失败，重新构建")
+            return
+
+        self.entries = entries
+
+    def get(self, sha: str) -> Optional[Dict[str, Any]]:
+        entry = self.entries.get(sha)
+        if not isinstance(entry, dict) or not isinstance(entry.get("lines"), int) \
+                or not isinstance(entry.get("language"), str) \
+                or not isinstance(entry.get("modification_potential"), (int, float)):
+            return None
+        self.seen.add(sha)
+        return entry
+
+    def put(self, sha: str, entry: Dict[str, Any]):
+        self.entries[sha] = entry
+        self.seen.add(sha)
+
+    def save(self):
+        # 只保留本次仍然存在的 blob，原子写入
+        entries = {sha: self.entries[sha] for sha in self.seen if sha in self.entries}
+        data = {
+            "version": CACHE_VERSION,
+            "fingerprint": self.fingerprint,
+            "checksum": self._checksum(entries),
+            "entries": entries,
+        }
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print_err(f"无法写入分析缓存: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
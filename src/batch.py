@@ -0,0 +1,97 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import git
+from call_llm import get_call_stats
+from commit_mirage import CommitMirage
+from main import build_opts, build_parser
+from rate_limiter import SharedTokenBucket, set_shared_limits
+from utils import print_err
+
+
+def _init_worker(semaphore, bucket):
+    set_shared_limits(semaphore, bucket)
+
+
+def _entry_argv(entry, common_argv):
+    # 清单中的每个仓库转换为 main.py 的命令行参数，公共参数在前，仓库自己的参数可以覆盖
+    argv = list(common_argv) + [str(arg) for arg in entry.get("args", [])]
+    for key, flag in (("start", "--start"), ("end", "--end"), ("times", "--times"), ("commit", "--commit")):
+        if entry.get(key) is not None:
+            argv += [flag, str(entry[key])]
+    return argv + [entry["dir"]]
+
+
+def _run_repository(argv):
+    # 在工作进程中运行一个仓库，解释器、SDK 和 LLM 客户端在同一进程的多个仓库之间复用
+    report = {"dir": argv[-1], "status": "ok"}
+    started = time.monotonic()
+    calls = len(get_call_stats())
+    try:
+        generator = CommitMirage(build_opts(build_parser().parse_args(argv)))
+        report["commit"] = generator.run()
+        report["head"] = git.get_head_hash(argv[-1])
+        report["timings"] = generator.timings
+    except SystemExit as e:
+        report["status"] = "failed"
+        report["exit_code"] = e.code
+    except Exception as e:
+        report["status"] = "error"
+        report["error"] = str(e)
+
+    stats = get_call_stats()[calls:]
+    report["llm_calls"] = len(stats)
+    report["input_tokens"] = sum(stat["input_tokens"] for stat in stats)
+    report["output_tokens"] = sum(stat["output_tokens"] for stat in stats)
+    report["duration"] = time.monotonic() - started
+    return report
+
+
+def _load_manifest(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if isinstance(manifest, dict):
+        manifest = manifest.get("repositories")
+    if not isinstance(manifest, list) or not all(isinstance(entry, dict) and "dir" in entry for entry in manifest):
+        raise Exception("清单格式错误，需要包含 dir 字段的仓库列表")
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Commit Mirage batch mode",
+                                     epilog="Other options are passed to every repository, see main.py.")
+    parser.add_argument("manifest", help="JSON list of repositories with dir, start, end, times, commit and args.")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="Worker processes.")
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="Concurrent LLM requests across all workers.")
+    parser.add_argument("--llm-rate-limit", type=float, help="LLM requests per minute across all workers.")
+    parser.add_argument("--report", type=str, default="batch-report.json", help="Summary report file.")
+    args, common_argv = parser.parse_known_args()
+
+    try:
+        manifest = _load_manifest(args.manifest)
+    except Exception as e:
+        print_err(f"无法读取清单: {e}")
+        sys.exit(1)
+
+    argvs = [_entry_argv(entry, common_argv) for entry in manifest]
+    semaphore = multiprocessing.Semaphore(max(1, args.llm_concurrency))
+    bucket = SharedTokenBucket(args.llm_rate_limit / 60) if args.llm_rate_limit else None
+
+    started = time.monotonic()
+    reports = []
+    with multiprocessing.Pool(max(1, min(args.workers, len(argvs))), initializer=_init_worker,
+                              initargs=(semaphore, bucket)) as pool:
+        for report in pool.imap(_run_repository, argvs):
+            print_err(f"{report['dir']}: {report['status']} {report.get('head', '')} {report['duration']:.1f}s")
+            reports.append(report)
+
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump({"duration": time.monotonic() - started, "repositories": reports}, f, indent=2,
+                  ensure_ascii=False)
+
+    if any(report["status"] != "ok" for report in reports):
+        sys.exit(7)
@@ -1,26 +1,328 @@
-from typing import Dict, Any
+import random
+import threading
+import time
+from contextlib import nullcontext
+from typing import Dict, Any, List, Tuple, Optional, Iterable, Union
 
 import anthropic
 import openai
 
+import profiler
+from json_stream import IncrementalJSONValidator, SchemaMismatch, parse_json
+from llm_cache import get_llm_cache
+from rate_limiter import get_concurrency_limiter, get_rate_limiter
+from utils import print_err
 
-def call_llm(llm_config: Dict[str, Any], prompt: str) -> str:
-    if llm_config["provider"] == "openai":
-        client = openai.OpenAI(api_key=llm_config["api_key"], base_url=llm_config["base_url"])
-        response = client.chat.completions.create(
-            model="gpt-4.1",
-            messages=[{"role": "user", "content": prompt}],
-        )
-        return response.choices[0].message.content
-    elif llm_config["provider"] == "anthropic":
-        client = anthropic.Anthropic(api_key=llm_config["api_key"], base_url=llm_config["base_url"])
-        response = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=6500,
-            messages=[{"role": "user", "content": prompt}]
-        )
-
-        if response.stop_reason == "end_turn":
-            return response.content[0].text
-
-    raise Exception
+DEFAULT_MODELS = {
+    "openai": "gpt-4.1",
+    "anthropic": "claude-sonnet-4-20250514",
+}
+DEFAULT_MAX_TOKENS = 6500
+DEFAULT_MAX_RETRIES = 5
+MAX_CONTINUATIONS = 3
+MAX_SCHEMA_RETRIES = 2
+
+# 提示词可以是字符串，也可以是 {"text": ..., "cache": bool} 块列表，可缓存的稳定块放在前面
+Prompt = Union[str, List[Dict[str, Any]]]
+
+_clients = {}
+_clients_lock = threading.Lock()
+_stats = []
+_stats_lock = threading.Lock()
+
+
+def get_client(provider: str, base_url: str, api_key: str):
+    # 每个 (provider, base_url, api_key) 只创建一个客户端，复用 HTTP 连接
+    key = (provider, base_url, api_key)
+    with _clients_lock:
+        if key not in _clients:
+            if provider == "openai":
+                _clients[key] = openai.OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+            elif provider == "anthropic":
+                _clients[key] = anthropic.Anthropic(api_key=api_key, base_url=base_url, max_retries=0)
+            else:
+                raise Exception(f"不支持的 LLM 服务提供商: {provider}")
+        return _clients[key]
+
+
+def _is_retryable(error: Exception) -> bool:
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code == 429 or status_code >= 500
+    return isinstance(error, (openai.APIConnectionError, anthropic.APIConnectionError))
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            return float(response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            pass
+    # 指数退避加随机抖动
+    return random.uniform(0, min(60.0, 2.0 ** attempt))
+
+
+def prompt_text(prompt: Prompt) -> str:
+    if isinstance(prompt, str):
+        return prompt
+    return "".join(block["text"] for block in prompt)
+
+
+def _user_message(llm_config: Dict[str, Any], prompt: Prompt) -> Dict[str, Any]:
+    # 可缓存的稳定前缀放在最前面：Anthropic 使用 cache_control 标记，OpenAI 依靠相同前缀自动缓存
+    if isinstance(prompt, str) or llm_config["provider"] != "anthropic":
+        return {"role": "user", "content": prompt_text(prompt)}
+
+    content = []
+    for block in prompt:
+        item = {"type": "text", "text": block["text"]}
+        if block.get("cache"):
+            item["cache_control"] = {"type": "ephemeral"}
+        content.append(item)
+    return {"role": "user", "content": content}
+
+
+def _record_usage(stat: Dict[str, Any], input_tokens, output_tokens, cache_read_tokens=0, cache_write_tokens=0):
+    stat["input_tokens"] += input_tokens or 0
+    stat["output_tokens"] += output_tokens or 0
+    stat["cache_read_tokens"] += cache_read_tokens or 0
+    stat["cache_write_tokens"] += cache_write_tokens or 0
+
+
+def _record_openai_usage(stat: Dict[str, Any], usage):
+    details = getattr(usage, "prompt_tokens_details", None)
+    _record_usage(stat, usage.prompt_tokens, usage.completion_tokens, getattr(details, "cached_tokens", 0))
+
+
+def _record_anthropic_usage(stat: Dict[str, Any], usage):
+    # Anthropic 的 input_tokens 不包含缓存部分，这里统一记录为总输入
+    cache_read_tokens = getattr(usage, "cache_read_input_tokens", 0) or 0
+    cache_write_tokens = getattr(usage, "cache_creation_input_tokens", 0) or 0
+    _record_usage(stat, usage.input_tokens + cache_read_tokens + cache_write_tokens, usage.output_tokens,
+                  cache_read_tokens, cache_write_tokens)
+
+
+def _feed(validator: Optional[IncrementalJSONValidator], stat: Dict[str, Any], started: float, text: str):
+    if stat["ttft"] is None and len(text) > 0:
+        stat["ttft"] = time.monotonic() - started
+    if validator is not None:
+        validator.feed(text)
+
+
+def _truncated(validator: Optional[IncrementalJSONValidator], truncated: bool) -> bool:
+    # 对象已经完整时即使达到长度上限也不需要续写
+    return truncated and (validator is None or not validator.complete)
+
+
+def _complete_openai(client, llm_config: Dict[str, Any], messages: List[Dict],
+                     validator: Optional[IncrementalJSONValidator], stat: Dict[str, Any]) -> Tuple[str, bool]:
+    options = {}
+    if llm_config.get("max_tokens"):
+        options["max_tokens"] = llm_config["max_tokens"]
+    model = llm_config.get("model") or DEFAULT_MODELS["openai"]
+    started = time.monotonic()
+
+    if not llm_config.get("stream"):
+        response = client.chat.completions.create(model=model, messages=messages, **options)
+        if response.usage is not None:
+            _record_openai_usage(stat, response.usage)
+        choice = response.choices[0]
+        if choice.finish_reason not in ("stop", "length"):
+            raise Exception(f"LLM 异常结束: {choice.finish_reason}")
+        return choice.message.content or "", choice.finish_reason == "length"
+
+    # 流式输出，边接收边校验，不符合格式时立即中断；格式正确时读完整个流以拿到最后的 usage
+    parts = []
+    finish_reason = None
+    stream = client.chat.completions.create(model=model, messages=messages, stream=True,
+                                            stream_options={"include_usage": True}, **options)
+    try:
+        for chunk in stream:
+            if chunk.usage is not None:
+                _record_openai_usage(stat, chunk.usage)
+            if len(chunk.choices) == 0:
+                continue
+            choice = chunk.choices[0]
+            if choice.finish_reason is not None:
+                finish_reason = choice.finish_reason
+            text = choice.delta.content or ""
+            parts.append(text)
+            _feed(validator, stat, started, text)
+    finally:
+        stream.close()
+
+    if finish_reason not in ("stop", "length"):
+        raise Exception(f"LLM 异常结束: {finish_reason}")
+    return "".join(parts), _truncated(validator, finish_reason == "length")
+
+
+def _complete_anthropic(client, llm_config: Dict[str, Any], messages: List[Dict],
+                        validator: Optional[IncrementalJSONValidator], stat: Dict[str, Any]) -> Tuple[str, bool]:
+    options = {
+        "model": llm_config.get("model") or DEFAULT_MODELS["anthropic"],
+        "max_tokens": llm_config.get("max_tokens") or DEFAULT_MAX_TOKENS,
+        "messages": messages,
+    }
+    started = time.monotonic()
+
+    if not llm_config.get("stream"):
+        response = client.messages.create(**options)
+    else:
+        # 流式输出，边接收边校验，不符合格式时立即中断；格式正确时读完整个流以拿到最终消息和 usage
+        with client.messages.stream(**options) as stream:
+            for text in stream.text_stream:
+                _feed(validator, stat, started, text)
+            response = stream.get_final_message()
+
+    _record_anthropic_usage(stat, response.usage)
+    if response.stop_reason not in ("end_turn", "stop_sequence", "max_tokens"):
+        raise Exception(f"LLM 异常结束: {response.stop_reason}")
+    text = "".join(block.text for block in response.content if block.type == "text")
+    return text, _truncated(validator, response.stop_reason == "max_tokens")
+
+
+def _complete(llm_config: Dict[str, Any], messages: List[Dict],
+              validator: Optional[IncrementalJSONValidator], stat: Dict[str, Any]) -> Tuple[str, bool]:
+    client = get_client(llm_config["provider"], llm_config["base_url"], llm_config["api_key"])
+    limiter = get_rate_limiter(llm_config["provider"], llm_config.get("rate_limit"))
+    max_retries = llm_config.get("max_retries", DEFAULT_MAX_RETRIES)
+
+    # 续写时沿用之前的解析状态；传输错误重试时丢弃失败请求已经输入的部分
+    checkpoint = validator.snapshot() if validator is not None else None
+    attempt = 0
+    while True:
+        if validator is not None:
+            validator.restore(checkpoint)
+        if limiter is not None:
+            limiter.acquire()
+        semaphore = get_concurrency_limiter()
+        try:
+            with semaphore if semaphore is not None else nullcontext(), profiler.span("llm_request", "llm"):
+                if llm_config["provider"] == "openai":
+                    return _complete_openai(client, llm_config, messages, validator, stat)
+                return _complete_anthropic(client, llm_config, messages, validator, stat)
+        except Exception as e:
+            if attempt >= max_retries or not _is_retryable(e):
+                raise
+            time.sleep(_retry_delay(e, attempt))
+            attempt += 1
+            stat["retries"] += 1
+
+
+def get_call_stats() -> List[Dict[str, Any]]:
+    with _stats_lock:
+        return list(_stats)
+
+
+def _finish_stat(llm_config: Dict[str, Any], stat: Dict[str, Any], started: float):
+    stat["duration"] = time.monotonic() - started
+    generating = stat["duration"] - (stat["ttft"] or 0)
+    # 提前中断的流式响应没有 usage，按字符数估算 token 数
+    output_tokens = stat["output_tokens"] or stat["output_chars"] // 4
+    if output_tokens > 0 and generating > 0:
+        stat["tokens_per_second"] = output_tokens / generating
+    with _stats_lock:
+        _stats.append(stat)
+    profiler.record_llm_call(stat)
+
+    if llm_config.get("debug"):
+        ttft = "-" if stat["ttft"] is None else f"{stat['ttft']:.2f}s"
+        print_err(f"LLM 调用: 首个 token {ttft}，耗时 {stat['duration']:.2f}s，"
+                  f"输出 {output_tokens} tokens，{stat['tokens_per_second']:.1f} tokens/s，"
+                  f"缓存命中 {stat['cache_read_tokens']}/{stat['input_tokens']} 输入 tokens，"
+                  f"重试 {stat['retries']} 次，格式重试 {stat['schema_retries']} 次")
+
+
+def call_llm(llm_config: Dict[str, Any], prompt: Prompt, expected_keys: Optional[Iterable[str]] = None) -> str:
+    cache = get_llm_cache(llm_config.get("cache_dir"))
+    if cache is None:
+        return _call_llm(llm_config, prompt, expected_keys)
+
+    model = llm_config.get("model") or DEFAULT_MODELS.get(llm_config["provider"])
+    key = cache.key(llm_config["provider"], model, prompt_text(prompt))
+    if not llm_config.get("cache_bypass"):
+        response = cache.get(key)
+        if response is not None:
+            profiler.count("llm_cache_hits")
+            return response
+
+    response = _call_llm(llm_config, prompt, expected_keys)
+    cache.put(key, response)
+    return response
+
+
+def _call_llm(llm_config: Dict[str, Any], prompt: Prompt, expected_keys: Optional[Iterable[str]]) -> str:
+    stat = {
+        "provider": llm_config["provider"],
+        "model": llm_config.get("model") or DEFAULT_MODELS.get(llm_config["provider"]),
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "output_chars": 0,
+        "cache_read_tokens": 0,
+        "cache_write_tokens": 0,
+        "ttft": None,
+        "duration": 0.0,
+        "tokens_per_second": 0.0,
+        "retries": 0,
+        "schema_retries": 0,
+    }
+    started = time.monotonic()
+
+    try:
+        with profiler.span("llm_call", "llm", provider=stat["provider"], model=stat["model"]):
+            # 响应不符合预期 JSON 格式时立即重新请求
+            for _ in range(MAX_SCHEMA_RETRIES):
+                try:
+                    return _generate(llm_config, prompt, expected_keys, stat)
+                except SchemaMismatch:
+                    stat["schema_retries"] += 1
+            return _generate(llm_config, prompt, expected_keys, stat)
+    finally:
+        _finish_stat(llm_config, stat, started)
+
+
+def _generate(llm_config: Dict[str, Any], prompt: Prompt, expected_keys: Optional[Iterable[str]],
+              stat: Dict[str, Any]) -> str:
+    validator = IncrementalJSONValidator(expected_keys) if expected_keys else None
+    messages = [_user_message(llm_config, prompt)]
+    text = ""
+    stripped = ""
+
+    for _ in range(MAX_CONTINUATIONS + 1):
+        part, truncated = _complete(llm_config, messages, validator, stat)
+        stat["output_chars"] += len(part)
+        # 续写前去掉的结尾空白是模型真实输出的一部分，续写没有重新输出空白时补回去
+        if not part[:1].isspace():
+            part = stripped + part
+        stripped = ""
+        text += part
+        if not truncated:
+            if expected_keys:
+                _check_schema(text, expected_keys)
+            return text
+
+        # 输出被 max_tokens 截断时，让模型从中断处继续
+        if llm_config["provider"] == "anthropic":
+            # 预填的 assistant 消息不能以空白结尾，只去掉发送的前缀中的空白
+            prefill = text.rstrip()
+            stripped = text[len(prefill):]
+            text = prefill
+            messages = [messages[0], {"role": "assistant", "content": prefill}]
+        else:
+            messages = [
+                messages[0],
+                {"role": "assistant", "content": text},
+                {"role": "user", "content": "请从上次中断的地方继续输出，不要重复已经输出的内容。"}
+            ]
+
+    raise Exception("LLM 输出超过最大长度")
+
+
+def _check_schema(text: str, expected_keys: Iterable[str]):
+    try:
+        result = parse_json(text)
+    except ValueError as e:
+        raise SchemaMismatch(f"无法解析 JSON: {e}")
+    if not isinstance(result, dict) or not set(expected_keys).issubset(result):
+        raise SchemaMismatch("缺少预期字段")
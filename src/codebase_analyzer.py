@@ -1,17 +1,79 @@
 import fnmatch
+import heapq
 import json
 import os
 import random
+import re
+from itertools import compress
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Tuple, Optional
 
+import git
+import profiler
+from analysis_cache import AnalysisCache
 from call_llm import call_llm
+from context_slicer import CONTEXT_LINES, MAX_REGION_LINES, find_regions
+from file_table import FileTable
+from json_stream import parse_json
 from utils import print_err
 
+# 忽略的目录名模式，编译为单个正则
+_IGNORED_DIRECTORY = re.compile("|".join(fnmatch.translate(os.path.normcase(pattern)) for pattern in [
+    "*node_modules", "*.git", "*venv", "*__pycache__",
+    "*target", "*build", "*dist", "*.pytest_cache",
+    "*vendor", "*third_party", "*.gradle", "*cmake-build-*",
+    "*.idea", "*.vscode", "*bin", "*obj"
+]))
+
+DEFAULT_MAX_FILE_SIZE = 512 * 1024
+MIN_CANDIDATE_LINES = 20
+MAX_CANDIDATE_LINES = 600
+MAX_CANDIDATES = 21
+# 指定 rev 时只读取按大小估算最有希望的这么多个文件，其余文件按平均行长估算行数
+SHORTLIST_FILES = 5 * MAX_CANDIDATES
+ESTIMATED_LINE_BYTES = 32
+
+SELECTION_INSTRUCTIONS = """
+        你是一个代码分析专家。我需要你帮我选择在一个代码仓库中要修改的文件，用于创建一组Git提交。提交数量、需要选择的文件数量和代码仓库概要在最后给出。
+
+        要求：
+        1. 按给出的数量选择不同的文件进行修改，不能重复选择文件！
+        2. 每个文件要能支持"添加功能->删除功能"的操作序列
+        3. 优先选择具有以下特征的文件：
+           - 有函数和类可以扩展
+           - 大小适中（50-500行）
+           - 不是配置文件或测试文件
+        4. 对每个选中的文件，建议具体的修改策略
+
+        请直接以JSON格式返回你的选择，不需要其他说明，确保返回结果能被Python的json.loads()解析，不需要返回markdown代码块：
+        {
+            "selected_files": [
+                {
+                    "file_path": "path/to/file.py",
+                    "reason": "选择理由",
+                    "modification_strategy": "具体的修改策略",
+                    "operations": ["add_function", "add_logging", "remove_additions"]
+                }
+            ]
+        }
+        """
+
+
+def _count_newlines(data: bytes) -> int:
+    lines = data.count(b"\n")
+    if len(data) > 0 and not data.endswith(b"\n"):
+        lines += 1
+    return lines
+
 
 class CodebaseAnalyzer:
-    def __init__(self, llm_config: Dict[str, Any]):
+    def __init__(self, llm_config: Dict[str, Any], use_git_ls_files: bool = False,
+                 max_file_size: int = DEFAULT_MAX_FILE_SIZE, use_cache: bool = False, slice_lines: int = 0):
         self.llm_config = llm_config
+        self.use_git_ls_files = use_git_ls_files
+        self.max_file_size = max_file_size
+        self.use_cache = use_cache
+        self.slice_lines = slice_lines
 
         self.supported_languages = {
             ".py": "python",
@@ -28,7 +90,7 @@ class CodebaseAnalyzer:
             ".h": "c",
         }
 
-    def analyze_repository(self, repo_path: Path) -> Dict[str, Any]:
+    def analyze_repository(self, repo_path: Path, rev: Optional[str] = None) -> Dict[str, Any]:
         summary = {
             "total_files": 0,
             "code_files": [],
@@ -36,101 +98,242 @@ class CodebaseAnalyzer:
             "language_distribution": {},
         }
 
-        # 收集基本文件信息
-        code_files = self._collect_code_files(repo_path)
+        # 收集基本文件信息，指定 rev 时直接从对象库读取该版本的树
+        with profiler.span("collect_files", "analyze", rev=rev):
+            if rev is None:
+                code_files = self._collect_code_files(repo_path)
+            else:
+                code_files = self._collect_revision_files(repo_path, rev)
         summary["code_files"] = code_files
         summary["total_files"] = len(code_files)
+        profiler.count("files_scanned", len(code_files))
 
         # 统计语言分布
-        summary["language_distribution"] = self._analyze_language_distribution(code_files)
+        with profiler.span("language_distribution", "analyze"):
+            summary["language_distribution"] = self._analyze_language_distribution(code_files)
 
         # 分析文件复杂度和修改候选
-        summary["modification_candidates"] = self._analyze_modification_candidates(code_files)
+        with profiler.span("modification_candidates", "analyze"):
+            summary["modification_candidates"] = self._analyze_modification_candidates(code_files)
 
         return summary
 
-    def _collect_code_files(self, repo_path: Path) -> List[Dict[str, Any]]:
-        code_files = []
-
-        # 扩展的忽略模式
-        ignore_patterns = [
-            "*node_modules/*", "*.git/*", "*venv/*", "*__pycache__/*",
-            "*target/*", "*build/*", "*dist/*", "*.pytest_cache/*",
-            "*vendor/*", "*third_party/*", "*.gradle/*", "*cmake-build-*/*",
-            "*.idea/*", "*.vscode/*", "*bin/*", "*obj/*",
-            "*node_modules\\*", "*.git\\*", "*venv\\*", "*__pycache__\\*",
-            "*target\\*", "*build\\*", "*dist\\*", "*.pytest_cache\\*",
-            "*vendor\\*", "*third_party\\*", "*.gradle\\*", "*cmake-build-*\\*",
-            "*.idea\\*", "*.vscode\\*", "*bin\\*", "*obj\\*"
-        ]
-
-        top_levels = os.listdir(str(repo_path))
-        queries = []
-        for toplevel in top_levels:
-            fullpath = os.path.join(str(repo_path), toplevel)
-            if os.path.isdir(fullpath):
-                fullpath += os.path.sep
-                if not any(fnmatch.fnmatch(fullpath, pattern) for pattern in ignore_patterns):
-                    queries.append(fullpath)
-
-        all = []
-        for toplevel in top_levels:
-            fullpath = os.path.join(str(repo_path), toplevel)
-            if os.path.isfile(fullpath):
-                all.append(Path(fullpath))
-
-        for query in queries:
-            all += Path(query).rglob("*")
-
-        for file_path in all:
-            if file_path.is_file() and file_path.suffix in self.supported_languages:
-                relative_path = file_path.relative_to(repo_path)
-                if any(fnmatch.fnmatch(str(relative_path), pattern) for pattern in ignore_patterns):
+    def _collect_code_files(self, repo_path: Path) -> FileTable:
+        code_files = FileTable(str(repo_path))
+
+        if self.use_git_ls_files:
+            files = self._list_git_files(repo_path)
+        else:
+            files = self._walk_code_files(repo_path)
+
+        cache = None
+        blob_shas = {}
+        if self.use_cache:
+            cache = self._open_cache(repo_path)
+            blob_shas = git.ls_blob_shas(str(repo_path))
+
+        for relative_path, absolute_path in files:
+            try:
+                stat = os.stat(absolute_path)
+                # 超过大小上限的文件（通常是生成代码）不读取内容，直接跳过
+                if stat.st_size > self.max_file_size:
                     continue
 
-                try:
-                    file_info = {
-                        "path": str(relative_path),
-                        "absolute_path": str(file_path),
-                        "language": self.supported_languages[file_path.suffix],
-                        "size": file_path.stat().st_size,
-                        "lines": self._count_lines(file_path),
-                        "modification_potential": 0.0,
-                        "last_modified": file_path.stat().st_mtime
-                    }
-
-                    file_info["modification_potential"] = self._calculate_modification_potential(file_info)
-                    code_files.append(file_info)
-
-                except Exception as e:
-                    print_err(f"跳过文件 {file_path}: {e}")
-                    continue
+                self._add_file(
+                    code_files, relative_path, stat.st_size, stat.st_mtime,
+                    blob_shas.get(relative_path.replace(os.sep, "/")), cache,
+                    lambda: self._count_lines(absolute_path),
+                    lambda: Path(absolute_path).read_bytes()
+                )
+
+            except Exception as e:
+                print_err(f"跳过文件 {absolute_path}: {e}")
+                continue
+
+        if cache is not None:
+            cache.save()
 
         return code_files
 
-    def _count_lines(self, file_path: Path) -> int:
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            return len(f.readlines())
+    def _collect_revision_files(self, repo_path: Path, rev: str) -> FileTable:
+        # 通过 git ls-tree 获取路径和大小，只对入围文件用 cat-file --batch 读取内容，不需要检出
+        code_files = FileTable(str(repo_path))
+        cache = self._open_cache(repo_path) if self.use_cache else None
+        commit_time = int(git.get_commit_time(rev, str(repo_path)))
+
+        entries = []
+        for path, mode, sha, size in git.ls_tree_files(rev, str(repo_path)):
+            parts = path.split("/")
+            if mode not in ("100644", "100755") or os.path.splitext(parts[-1])[1] not in self.supported_languages:
+                continue
+            if any(_IGNORED_DIRECTORY.match(os.path.normcase(part)) for part in parts[:-1]):
+                continue
+            if size > self.max_file_size:
+                continue
+            entries.append((path, os.path.join(*parts), sha, size))
+
+        shortlist = self._shortlist(entries, cache)
+        profiler.count("blobs_skipped", len(entries) - len(shortlist))
+        for i, (path, relative_path, sha, size) in enumerate(entries):
+            if i not in shortlist:
+                language = self.supported_languages[os.path.splitext(relative_path)[1]]
+                lines = self._estimate_lines(size)
+                code_files.append(relative_path, language, size, lines,
+                                  self._estimate_potential(language, lines), commit_time, measured=False)
+                continue
+
+            try:
+                self._add_file(
+                    code_files, relative_path, size, commit_time, sha, cache,
+                    lambda: self._count_blob_lines(sha, str(repo_path)),
+                    lambda: git.get_blob(sha, str(repo_path))
+                )
+
+            except Exception as e:
+                print_err(f"跳过文件 {rev}:{path}: {e}")
+                continue
+
+        if cache is not None:
+            cache.save()
 
-    def _analyze_language_distribution(self, code_files: List[Dict]) -> Dict[str, Dict]:
-        distribution = {}
+        return code_files
 
-        for file_info in code_files:
-            lang = file_info["language"]
-            if lang not in distribution:
-                distribution[lang] = {
-                    "file_count": 0,
-                    "total_lines": 0,
-                    "total_size": 0,
-                    "avg_complexity": 0.0,
-                    "functions": 0,
-                    "classes": 0
-                }
+    def _estimate_lines(self, size: int) -> int:
+        return (size + ESTIMATED_LINE_BYTES - 1) // ESTIMATED_LINE_BYTES
+
+    def _estimate_potential(self, language: str, lines: int) -> float:
+        # 估算的行数超过切片阈值时，假设能找到区域，读取内容后再确认
+        return self._calculate_modification_potential(language, lines, 0 < self.slice_lines < lines)
+
+    def _shortlist(self, entries: List[Tuple[str, str, str, int]], cache: Optional[AnalysisCache]) -> set:
+        # 分析缓存命中的文件不需要读取内容，直接入围；其余文件按 ls-tree 给出的大小估算分数，只读取最有希望的一部分
+        shortlist = set()
+        others = []
+        for i, (path, relative_path, sha, size) in enumerate(entries):
+            if cache is not None and cache.get(sha) is not None:
+                shortlist.add(i)
+            else:
+                others.append(i)
+
+        def estimate(i):
+            lines = self._estimate_lines(entries[i][3])
+            language = self.supported_languages[os.path.splitext(entries[i][1])[1]]
+            return (self._is_eligible(lines, 0 < self.slice_lines < lines, True),
+                    self._estimate_potential(language, lines))
+
+        shortlist.update(heapq.nlargest(SHORTLIST_FILES, others, key=estimate))
+        return shortlist
+
+    def _add_file(self, code_files: FileTable, relative_path: str, size: int, last_modified: float,
+                  sha: Optional[str], cache: Optional[AnalysisCache], count_lines, read):
+        language = self.supported_languages[os.path.splitext(relative_path)[1]]
+        cached = cache.get(sha) if cache is not None and sha is not None else None
+        if cached is not None and cached["language"] == language:
+            profiler.count("analysis_cache_hits")
+            entry = dict(cached)
+        else:
+            entry = {"language": language, "size": size, "lines": count_lines()}
+        lines = entry["lines"]
+
+        # 超过切片阈值的文件只有确实能找到函数或类区域时才会被切片发送，结果只与内容有关，可以缓存
+        sliceable = False
+        if 0 < self.slice_lines < lines:
+            if not isinstance(entry.get("sliceable"), bool):
+                entry["sliceable"] = self._has_regions(read(), language)
+            sliceable = entry["sliceable"]
+
+        # 分数与切片设置有关，每次按当前设置重新计算
+        modification_potential = self._calculate_modification_potential(language, lines, sliceable)
+        entry["modification_potential"] = modification_potential
+        if cache is not None and sha is not None and entry != cached:
+            cache.put(sha, entry)
+
+        code_files.append(relative_path, language, size, lines, modification_potential, last_modified, sliceable)
+
+    def _has_regions(self, data: bytes, language: str) -> bool:
+        # 无法按 UTF-8 解码的文件生成阶段同样无法读取
+        try:
+            content = data.decode("utf-8")
+        except UnicodeDecodeError:
+            return False
+        with profiler.span("find_regions", "analyze", lines=_count_newlines(data)):
+            return len(find_regions(content, language)) > 0
+
+    def _open_cache(self, repo_path: Path) -> AnalysisCache:
+        path = os.path.join(git.get_common_dir(str(repo_path)), "commit-mirage", "analysis.json")
+        fingerprint = json.dumps(self.supported_languages, sort_keys=True)
+        return AnalysisCache(path, fingerprint)
+
+    def _walk_code_files(self, repo_path: Path) -> Iterator[Tuple[str, str]]:
+        # 在进入目录之前就剪掉被忽略的目录，避免遍历 node_modules 等大目录
+        stack = [(str(repo_path), "")]
+        while stack:
+            directory, relative_directory = stack.pop()
+            try:
+                entries = os.scandir(directory)
+            except OSError as e:
+                print_err(f"跳过目录 {directory}: {e}")
+                continue
+
+            with entries:
+                for entry in entries:
+                    relative_path = os.path.join(relative_directory, entry.name)
+                    if entry.is_dir(follow_symlinks=False):
+                        if not _IGNORED_DIRECTORY.match(os.path.normcase(entry.name)):
+                            stack.append((entry.path, relative_path))
+                    elif os.path.splitext(entry.name)[1] in self.supported_languages and entry.is_file():
+                        yield relative_path, entry.path
+
+    def _list_git_files(self, repo_path: Path) -> Iterator[Tuple[str, str]]:
+        # 通过 git ls-files 枚举文件，自动遵循 .gitignore
+        for path in git.ls_files(str(repo_path)):
+            parts = path.split("/")
+            if os.path.splitext(parts[-1])[1] not in self.supported_languages:
+                continue
+            if any(_IGNORED_DIRECTORY.match(os.path.normcase(part)) for part in parts[:-1]):
+                continue
+
+            relative_path = os.path.join(*parts)
+            yield relative_path, os.path.join(str(repo_path), relative_path)
+
+    def _count_blob_lines(self, sha: str, dir: str) -> int:
+        data = git.get_blob(sha, dir)
+        profiler.count("bytes_read", len(data))
+        return _count_newlines(data)
+
+    def _count_lines(self, file_path: str) -> int:
+        # 直接在字节上统计换行符，不解码也不构建行列表
+        lines = 0
+        last = b"\n"
+        with open(file_path, 'rb') as f:
+            while True:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    break
+                lines += chunk.count(b"\n")
+                last = chunk[-1:]
+                profiler.count("bytes_read", len(chunk))
+
+        if last != b"\n":
+            lines += 1
+        return lines
+
+    def _analyze_language_distribution(self, code_files: FileTable) -> Dict[str, Dict]:
+        distribution = {}
 
-            dist = distribution[lang]
-            dist["file_count"] += 1
-            dist["total_lines"] += file_info["lines"]
-            dist["total_size"] += file_info["size"]
+        # 按语言编码对整列聚合，语言按首次出现的顺序排列。指定 rev 时未入围文件的行数是按大小估算的
+        counts = code_files.count_by_language()
+        total_lines = code_files.sum_by_language(code_files.lines)
+        total_sizes = code_files.sum_by_language(code_files.sizes)
+        for code, lang in enumerate(code_files.language_names):
+            distribution[lang] = {
+                "file_count": counts[code],
+                "total_lines": total_lines[code],
+                "total_size": total_sizes[code],
+                "avg_complexity": 0.0,
+                "functions": 0,
+                "classes": 0
+            }
 
         for lang_data in distribution.values():
             if lang_data["file_count"] > 0:
@@ -138,9 +341,8 @@ class CodebaseAnalyzer:
 
         return distribution
 
-    def _calculate_modification_potential(self, file_info: Dict) -> float:
+    def _calculate_modification_potential(self, language: str, lines: int, sliceable: bool = False) -> float:
         score = 1.0
-        language = file_info["language"]
 
         # 根据编程语言调整分数
         language_multipliers = {
@@ -155,8 +357,11 @@ class CodebaseAnalyzer:
         multiplier = language_multipliers.get(language, 1.0)
         score *= multiplier
 
+        # 能切片的大文件只发送一个区域及其上下文，按区域的最大长度评分，与中等大小的文件竞争
+        if sliceable:
+            lines = min(lines, MAX_REGION_LINES + 2 * CONTEXT_LINES)
+
         # 根据文件大小调整分数
-        lines = file_info["lines"]
         if 100 <= lines <= 300:
             score += 8
         elif 50 <= lines < 100 or 300 < lines <= 500:
@@ -210,29 +415,32 @@ class CodebaseAnalyzer:
 
         return operations
 
-    def _analyze_modification_candidates(self, code_files: List[Dict]) -> List[Dict]:
-        candidates = []
+    def _is_eligible(self, lines: int, sliceable: bool, measured: bool) -> bool:
+        # 能切片的大文件不受行数上限限制；只按大小估算行数的文件不作为候选
+        return measured and MIN_CANDIDATE_LINES <= lines and (lines <= MAX_CANDIDATE_LINES or sliceable)
 
-        for file_info in code_files:
-            min_lines = 20
-            max_lines = 600
+    def _analyze_modification_candidates(self, code_files: FileTable) -> List[Dict]:
+        eligible = compress(range(len(code_files)), map(
+            self._is_eligible, code_files.lines, code_files.sliceable, code_files.measured
+        ))
 
-            if min_lines <= file_info["lines"] <= max_lines:
-                candidate = {
-                    "file_info": file_info,
-                    "modification_potential": file_info["modification_potential"],
-                    "suggested_operations": self._suggest_operations_for_language(file_info),
-                    "language_specific_features": self._get_language_features(file_info)
-                }
-                candidates.append(candidate)
+        # 按修改潜力和语言多样性取前 21 个，与降序的稳定排序结果一致，只为入选的文件构建字典
+        top = heapq.nlargest(MAX_CANDIDATES, eligible, key=lambda i: (
+            code_files.potentials[i],
+            code_files.language(i)  # 优先选择不同语言的文件
+        ))
 
-        # 按修改潜力和语言多样性排序
-        candidates.sort(key=lambda x: (
-            x["modification_potential"],
-            x["file_info"]["language"]  # 优先选择不同语言的文件
-        ), reverse=True)
+        candidates = []
+        for i in top:
+            file_info = code_files[i]
+            candidates.append({
+                "file_info": file_info,
+                "modification_potential": file_info["modification_potential"],
+                "suggested_operations": self._suggest_operations_for_language(file_info),
+                "language_specific_features": self._get_language_features(file_info)
+            })
 
-        return candidates[:21]
+        return candidates
 
     def _get_language_features(self, file_info: Dict) -> Dict[str, Any]:
         language = file_info["language"]
@@ -288,37 +496,22 @@ class CodebaseAnalyzer:
 
         file_count = random.randint(commits - 1, min(codebase_summary["total_files"], round(1.9 * commits)))
 
-        prompt = f"""
-        你是一个代码分析专家。我需要你帮我选择在一个代码仓库中要修改的文件，用于创建{commits}个Git提交。
+        # 固定的说明放在前面作为可缓存块，变化的数量和仓库概要放在后面
+        prompt = [
+            {"text": SELECTION_INSTRUCTIONS, "cache": True},
+            {"text": f"""
+        提交数量: {commits}
+        需要选择的文件数量: {file_count}
 
         代码仓库概要：
         {json.dumps(repo_overview, indent=2, ensure_ascii=False)}
-
-        要求：
-        1. 选择{file_count}个不同的文件进行修改，不能重复选择文件！
-        2. 每个文件要能支持"添加功能->删除功能"的操作序列
-        3. 优先选择具有以下特征的文件：
-           - 有函数和类可以扩展
-           - 大小适中（50-500行）
-           - 不是配置文件或测试文件
-        4. 对每个选中的文件，建议具体的修改策略
-
-        请直接以JSON格式返回你的选择，不需要其他说明，确保返回结果能被Python的json.loads()解析，不需要返回markdown代码块：
-        {{
-            "selected_files": [
-                {{
-                    "file_path": "path/to/file.py",
-                    "reason": "选择理由",
-                    "modification_strategy": "具体的修改策略",
-                    "operations": ["add_function", "add_logging", "remove_additions"]
-                }}
-            ]
-        }}
-        """
+        """}
+        ]
 
         try:
-            response = call_llm(self.llm_config, prompt)
-            result = json.loads(response)
+            with profiler.span("select_targets", "llm", files=file_count):
+                response = call_llm(self.llm_config, prompt, ("selected_files",))
+            result = parse_json(response)
             return result["selected_files"]
         except Exception as e:
             print_err(f"LLM选择失败，使用回退策略: {e}")
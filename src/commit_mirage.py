@@ -1,13 +1,24 @@
 import json
+import os
+import queue
+import shutil
 import sys
+import tempfile
+import threading
 import time
 from datetime import datetime
 from pathlib import Path
 from random import randrange
 
 import git
+import profiler
 from codebase_analyzer import CodebaseAnalyzer
+from committer import WorktreeCommitter, FastImportCommitter
+from ledger import Ledger
 from llm_refactorer import LLMRefactorer
+from planner import MAX_POOL_SIZE, build_commit_plan, required_pairs
+from run_state import RunState
+from splice import splice_history
 from utils import print_err
 
 TEMP_BRANCH_NAME = f"temp_{str(int(time.time()))}"
@@ -16,13 +27,26 @@ TEMP_BRANCH_NAME = f"temp_{str(int(time.time()))}"
 class CommitMirage:
     def __init__(self, opts):
         self.opts = opts
+        # 各阶段耗时（秒），供批量模式生成报告
+        self.timings = {}
         llm_config = {
             "provider": self.opts["provider"],
             "base_url": self.opts["base_url"],
-            "api_key": self.opts["api_key"]
+            "api_key": self.opts["api_key"],
+            "rate_limit": self.opts["rate_limit"],
+            "model": self.opts["model"],
+            "max_tokens": self.opts["max_tokens"],
+            "max_retries": self.opts["max_retries"],
+            "cache_dir": self.opts["llm_cache"],
+            "cache_bypass": self.opts["llm_cache_bypass"],
+            "stream": self.opts["stream"],
+            "debug": self.opts["debug"]
         }
-        self.analyzer = CodebaseAnalyzer(llm_config)
-        self.refactorer = LLMRefactorer(llm_config)
+        self.analyzer = CodebaseAnalyzer(llm_config, self.opts["git_ls_files"], self.opts["max_file_size"],
+                                         self.opts["analysis_cache"], self.opts["slice_lines"])
+        self.refactorer = LLMRefactorer(llm_config, self.opts["jobs"], self.opts["local_revert"],
+                                        self.opts["edit_format"], self.opts["batch_tokens"],
+                                        self.opts["slice_lines"])
 
     def print_debug(self, *args, **kwargs):
         if self.opts["debug"]:
@@ -33,105 +57,336 @@ class CommitMirage:
         interval = delta // (self.opts["times"] + 1)
         results = []
         for i in range(1, self.opts["times"] + 1):
-            results.append(self.opts["start"] + i * interval + randrange(-interval, interval))
+            offset = randrange(-interval, interval) if interval > 0 else 0
+            results.append(self.opts["start"] + i * interval + offset)
+        # 相邻区间的随机偏移会重叠，排序保证提交时间单调递增
+        results.sort()
         return results
 
+    def _start_producer(self, target_files, base, state):
+        # 生产者线程按顺序生成每个文件的修改，放入有界队列；队列满时生产者暂停，不再发出新的 LLM 请求。
+        # 提交结束或失败时设置 stop，生产者取消尚未开始的请求后退出
+        pairs = queue.Queue(maxsize=2 * max(1, self.opts["jobs"]))
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pairs.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            plan = self.refactorer.iter_refactor_plan(target_files, self.opts["dir"], base, state.get_files(),
+                                                      state.put_file, stop)
+            try:
+                for file_commits in plan:
+                    if not put(file_commits):
+                        return
+                put(None)
+            except Exception as e:
+                put(e)
+            finally:
+                plan.close()
+
+        threading.Thread(target=produce, daemon=True).start()
+        try:
+            while True:
+                item = pairs.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+    def _write_commits(self, committer, ledger, final_plan, random_times, source):
+        try:
+            self._write_plan(committer, ledger, final_plan, random_times, source)
+        finally:
+            # 提交完成或失败后关闭修改来源，流水线模式下会停止后台的生成
+            source.close()
+        return committer.finish()
+
+    def _write_plan(self, committer, ledger, final_plan, random_times, source):
+        refactor_plan = []
+        for i in range(0, self.opts["times"]):
+            t = random_times[i]
+            # 等待这个提交需要的修改全部到达
+            while len(refactor_plan) <= max(final_plan[i], default=-1):
+                file_commits = next(source, None)
+                if file_commits is None:
+                    raise Exception("生成的修改数量不足")
+                refactor_plan.extend(file_commits)
+            c = [refactor_plan[j] for j in final_plan[i]]
+            ledger.record(c)
+            if i == self.opts["times"] - 1:
+                # 最后一个提交前所有修改都已到达，没能恢复原样的文件直接写回原始内容
+                repairs = ledger.repairs()
+                for p in repairs:
+                    self.print_debug(f"文件未能恢复原样，已在最后一个提交中还原: {p['file_path']}")
+                c = c + repairs
+            if len(c) == 0:
+                continue
+
+            message = c[0]["commit_message"]
+            if len(message.strip()) == 0:
+                message = "Update"
+            committer.commit(c, message, t)
+            self.print_debug(f"{t} {datetime.fromtimestamp(t).isoformat()}")
+
+    def _create_committer(self, paths, base):
+        if self.opts["backend"] == "fast-import":
+            if self.opts["commit"] is not None:
+                ref = f"refs/heads/{TEMP_BRANCH_NAME}"
+            else:
+                ref = git.get_symbolic_ref(self.opts["dir"])
+                if ref is None:
+                    print_err("fast-import 模式不支持分离的 HEAD。")
+                    sys.exit(5)
+            return FastImportCommitter(ref, base, paths, self.opts["dir"])
+
+        return WorktreeCommitter(self.opts["dir"])
+
+    def _load_plan(self):
+        state = RunState(self.opts["apply"], None)
+        if not state.load(check_key=False):
+            print_err("无法读取计划文件。")
+            sys.exit(6)
+        return state
+
+    def _open_state(self, start, ref=None):
+        # 隔离模式下不同分支可以同时运行，各自使用独立的运行状态
+        name = "run.json" if ref is None else f"run-{ref.replace('/', '_')}.json"
+        path = os.path.join(git.get_common_dir(self.opts["dir"]), "commit-mirage", name)
+        state = RunState(path, {"base": start, "commit": self.opts["commit"], "times": self.opts["times"]})
+        if self.opts["resume"] and state.load():
+            self.print_debug("从上次的运行状态继续……")
+        return state
+
     def run(self):
-        if git.check_dirty(self.opts["dir"]):
+        if self.opts["profile"] is None:
+            return self._run()
+
+        # 性能分析：记录整个运行过程，失败退出时也导出已经记录的部分
+        profiler.enable()
+        try:
+            with profiler.span("run", "run", dir=self.opts["dir"], times=self.opts["times"]):
+                return self._run()
+        finally:
+            profiler.count("subprocesses_avoided", git.get_avoided_subprocesses())
+            profiler.export(self.opts["profile"], {"timings": self.timings})
+            profiler.disable()
+
+    def _run(self):
+        # 隔离模式不触碰用户的工作区，因此不要求工作区干净
+        if not self.opts["isolated"] and git.check_dirty(self.opts["dir"]):
             print_err("此程序只能在干净的工作目录中运行。")
             sys.exit(3)
 
         branch = None
         current = None
+        base = None
+        started = time.monotonic()
+
+        state = None
+        if self.opts["apply"] is not None:
+            # 离线应用计划时沿用生成计划时的参数
+            state = self._load_plan()
+            self.opts["commit"] = state.key["commit"]
+            self.opts["times"] = state.key["times"]
 
         if self.opts["commit"] is not None:
             branch = git.get_branch_name(self.opts["dir"])
             self.print_debug(f"branch name: {branch}")
-            git.new_branch(TEMP_BRANCH_NAME, self.opts["commit"], self.opts["dir"])
+            # cat-file 不会自动解开标签，显式取标签指向的提交
+            base = git.rev_parse(f"{self.opts['commit']}^{{commit}}", self.opts["dir"])
+
+        start = base if base is not None else git.get_head_hash(self.opts["dir"])
+        ref = None
+        if self.opts["isolated"]:
+            ref = git.get_symbolic_ref(self.opts["dir"])
+            if ref is None:
+                print_err("隔离模式不支持分离的 HEAD。")
+                sys.exit(5)
+            # 隔离模式始终从对象库读取起始版本，忽略工作区中未提交的改动
+            base = start
+
+        if state is None:
+            state = self._open_state(start, ref)
+        elif state.key["base"] != start or state.get("random_times") is None or state.get("refactor_plan") is None:
+            # 流水线运行中断后留下的状态没有完整的修改计划，应用时不能再调用 LLM 补全
+            print_err("计划文件与当前仓库不一致或尚未完成规划。")
+            sys.exit(6)
+
+        # 指定 commit 时直接从对象库分析该版本，规划阶段不需要检出
+        codebase_summary = state.get("codebase_summary")
+        if codebase_summary is None:
+            self.print_debug("分析仓库……")
+            codebase_summary = self.analyzer.analyze_repository(Path(self.opts["dir"]), base)
+            # 续跑只需要文件总数和修改候选，完整的文件表不写入运行状态
+            state.set("codebase_summary", {key: value for key, value in codebase_summary.items()
+                                           if key != "code_files"})
+        self.timings["analyze"] = time.monotonic() - started
 
-        self.print_debug("分析仓库……")
-        codebase_summary = self.analyzer.analyze_repository(Path(self.opts["dir"]))
-        self.print_debug("选择目标……")
-        target_files = self.analyzer.select_modification_targets(codebase_summary, self.opts["times"])
-        self.print_debug("创建计划……")
-        refactor_plan = self.refactorer.create_refactor_plan(target_files, self.opts["dir"])
+        target_files = state.get("target_files")
+        if target_files is None:
+            self.print_debug("选择目标……")
+            # 提交数量很多时只生成有限数量的修改并循环复用
+            pool_commits = min(self.opts["times"], MAX_POOL_SIZE + 1, codebase_summary["total_files"] + 1)
+            target_files = self.analyzer.select_modification_targets(codebase_summary, pool_commits)
+            state.set("target_files", target_files)
+        self.timings["select"] = time.monotonic() - started - self.timings["analyze"]
 
-        if len(refactor_plan) < 2 * (self.opts["times"] - 1):
+        # 只生成计划时需要完整的修改，不能使用流水线
+        pipeline = self.opts["pipeline"] and not self.opts["plan_only"] and state.get("refactor_plan") is None
+        refactor_plan = state.get("refactor_plan")
+        if pipeline:
+            # 流水线模式：每个文件对应一组修改，先按文件数量规划，修改到达后立即提交
+            pairs = len(target_files)
+        else:
+            if refactor_plan is None:
+                self.print_debug("创建计划……")
+                refactor_plan = self.refactorer.create_refactor_plan(target_files, self.opts["dir"], base,
+                                                                     state.get_files(), state.put_file)
+                state.set("refactor_plan", refactor_plan)
+            pairs = len(refactor_plan) // 2
+
+        if pairs < required_pairs(self.opts["times"]):
             print_err("项目内可以修改的文件不足。请降低提交次数。")
             sys.exit(4)
 
-        final_plan = []
-        add_plan = []
-        delete_plan = []
-        for i in range(len(refactor_plan)):
-            if i % 2 == 0:
-                add_plan.append(refactor_plan[i])
-            else:
-                delete_plan.append(refactor_plan[i])
-
-        if self.opts["times"] == 2:
-            count = len(add_plan) // 2
-            final_plan.append([])
-            final_plan.append([])
-            for i in range(0, count):
-                final_plan[0].append(add_plan[i])
-                final_plan[0].append(delete_plan[i])
-            final_plan[0].append(add_plan[count])
-            final_plan[1].append(delete_plan[count])
-            for i in range(count + 1, len(add_plan)):
-                final_plan[1].append(add_plan[i])
-                final_plan[1].append(delete_plan[i])
+        # 计划中保存修改的序号，提交时再取出对应的修改
+        final_plan = state.get("final_plan")
+        if final_plan is None:
+            final_plan = build_commit_plan(list(range(2 * pairs)), self.opts["times"])
+            state.set("final_plan", final_plan)
+        if not pipeline:
+            self.print_debug(json.dumps([[refactor_plan[j] for j in c] for c in final_plan], indent=2,
+                                        ensure_ascii=False))
+
+        random_times = state.get("random_times")
+        if random_times is None:
+            self.print_debug("选择时间……")
+            random_times = self.get_random_times()
+            state.set("random_times", random_times)
+
+        planned = time.monotonic()
+        self.timings["plan"] = planned - started - self.timings["analyze"] - self.timings["select"]
+
+        if self.opts["plan_only"]:
+            self.timings["total"] = time.monotonic() - started
+            print(state.path)
+            return None
+
+        paths = [os.path.join(self.opts["dir"], file_target["file_path"]) for file_target in target_files]
+        if pipeline:
+            source = self._start_producer(target_files, base, state)
         else:
-            left = len(add_plan) - 1
-            count = left // (self.opts["times"] - 2)
-            if left % (self.opts["times"] - 2) != 0:
-                count = count + 1
-            final_plan.append([add_plan[0]])
-            current = 0
-            for i in range(0, self.opts["times"] - 2):
-                final_plan.append([])
-                for j in range(0, count):
-                    if current == len(delete_plan) - 1:
-                        break
-                    final_plan[-1].append(delete_plan[current])
-                    current += 1
-                    final_plan[-1].append(add_plan[current])
-            final_plan.append([delete_plan[-1]])
-
-        self.print_debug(json.dumps(final_plan, indent=2, ensure_ascii=False))
-        self.print_debug("选择时间……")
-        random_times = self.get_random_times()
+            source = (refactor_plan[j:j + 2] for j in range(0, len(refactor_plan), 2))
 
-        for i in range(0, self.opts["times"]):
-            t = random_times[i]
-            c = final_plan[i]
-            if len(c) == 0:
-                continue
+        if self.opts["isolated"]:
+            current = self._commit_isolated(base, ref, paths, final_plan, random_times, source)
+            return self._finish_run(state, started, planned, current)
 
-            message = c[0]["commit_message"]
-            for p in c:
-                with open(p["file_path"], 'w', encoding='utf-8') as f:
-                    f.write(p["new_content"])
-            git.add_all(self.opts["dir"])
-            if len(message.strip()) == 0:
-                message = "Update"
-            git.commit_with_time(message, t, self.opts["dir"])
-            current = git.get_head_hash(self.opts["dir"])
-            self.print_debug(f"{t} {datetime.fromtimestamp(t).isoformat()}")
+        if base is None:
+            base = git.get_head_hash(self.opts["dir"])
+        elif self.opts["backend"] == "worktree":
+            git.new_branch(TEMP_BRANCH_NAME, base, self.opts["dir"])
 
-        patch = git.diff(f"{current}~{self.opts['times']}", current, self.opts["dir"])
-        if len(patch.strip()) != 0:
-            try:
-                git.apply_reverse(patch, self.opts["dir"])
-                git.add_all(self.opts["dir"])
-                git.commit_amend_with_time(random_times[-1], self.opts["dir"])
-                current = git.get_head_hash(self.opts["dir"])
-            except:
-                self.print_debug(patch)
+        committer = self._create_committer(paths, base)
+        ledger = Ledger(paths, base, self.opts["dir"])
+        try:
+            current = self._write_commits(committer, ledger, final_plan, random_times, source)
+        except BaseException:
+            print_err("生成提交时出错，正在恢复原始状态……")
+            committer.abort()
+            if self.opts["commit"] is not None and self.opts["backend"] == "worktree":
+                git.checkout(branch, self.opts["dir"])
+                git.delete_branch(TEMP_BRANCH_NAME, self.opts["dir"])
+            raise
 
+        unchanged = self._check_tree(current, base)
         if self.opts["commit"] is not None:
-            git.rebase(TEMP_BRANCH_NAME, branch, self.opts["dir"])
+            if unchanged and branch != "HEAD" and git.is_ancestor(base, branch, self.opts["dir"]):
+                # 净改动为零且 base 在当前分支上时，后代提交的树可以直接复用，不需要逐个 rebase
+                splice_history(base, current, f"refs/heads/{branch}", self.opts["dir"])
+            else:
+                git.rebase(TEMP_BRANCH_NAME, branch, self.opts["dir"])
             git.checkout(branch, self.opts["dir"])
             git.delete_branch(TEMP_BRANCH_NAME, self.opts["dir"])
 
+        return self._finish_run(state, started, planned, current)
+
+    def _check_tree(self, current, base):
+        # 只比较树对象的哈希即可确认净改动为零
+        tree = git.rev_parse(f"{current}^{{tree}}", self.opts["dir"])
+        unchanged = tree == git.rev_parse(f"{base}^{{tree}}", self.opts["dir"])
+        if not unchanged:
+            print_err(f"警告：生成的提交 {current} 与原始版本 {base} 的文件内容不一致！")
+        return unchanged
+
+    def _add_worktree(self, commit):
+        # 优先放在 tmpfs 上，所有文件写入都在内存中完成
+        parent = "/dev/shm" if os.access("/dev/shm", os.W_OK) else None
+        path = tempfile.mkdtemp(prefix="commit-mirage-", dir=parent)
+        try:
+            git.add_worktree(path, commit, self.opts["dir"])
+        except BaseException:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        return path
+
+    def _commit_isolated(self, base, ref, paths, final_plan, random_times, source):
+        # 在临时 worktree 或临时引用上提交，最后带旧值检查地更新目标引用，不触碰用户的工作区和索引
+        old_tip = git.rev_parse(ref, self.opts["dir"])
+        worktree = None
+        try:
+            if self.opts["backend"] == "worktree":
+                worktree = self._add_worktree(base)
+                committer = WorktreeCommitter(worktree, os.path.abspath(git.get_toplevel(self.opts["dir"])))
+            else:
+                temp_ref = f"refs/commit-mirage/{TEMP_BRANCH_NAME}_{os.getpid()}"
+                committer = FastImportCommitter(temp_ref, base, paths, self.opts["dir"])
+            ledger = Ledger(paths, base, self.opts["dir"])
+            try:
+                current = self._write_commits(committer, ledger, final_plan, random_times, source)
+            except BaseException:
+                print_err("生成提交时出错，目标分支保持不变。")
+                committer.abort()
+                raise
+            if self.opts["backend"] == "fast-import":
+                git.delete_ref(temp_ref, self.opts["dir"])
+
+            unchanged = self._check_tree(current, base)
+            ancestor = git.is_ancestor(base, old_tip, self.opts["dir"])
+            if old_tip == base:
+                git.update_ref(ref, current, old_tip, self.opts["dir"])
+            elif unchanged and ancestor:
+                splice_history(base, current, ref, self.opts["dir"])
+            else:
+                # 内容不一致或 base 不在目标分支上时只能逐个 rebase，同样在临时 worktree 中完成；
+                # 后一种情况与 git rebase TEMP branch 相同，重放目标分支上不属于生成提交的部分
+                if worktree is None:
+                    worktree = self._add_worktree(current)
+                git.rebase_onto(current, base if ancestor else current, old_tip, worktree)
+                git.update_ref(ref, git.get_head_hash(worktree), old_tip, self.opts["dir"])
+        finally:
+            if worktree is not None:
+                git.remove_worktree(worktree, self.opts["dir"])
+                shutil.rmtree(worktree, ignore_errors=True)
+        return current
+
+    def _finish_run(self, state, started, planned, current):
+        # 成功后删除默认运行状态，显式指定的计划文件保留
+        if self.opts["apply"] is None:
+            state.remove()
+
+        self.timings["commit"] = time.monotonic() - planned
+        self.timings["total"] = time.monotonic() - started
+        self.print_debug(f"git 会话节省了 {git.get_avoided_subprocesses()} 个子进程")
         print(current)
+        return current
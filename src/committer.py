@@ -0,0 +1,115 @@
+import os
+import time
+from subprocess import PIPE
+
+import git
+import profiler
+
+
+def _format_tz(t):
+    offset = time.localtime(t).tm_gmtoff // 60
+    sign = "+" if offset >= 0 else "-"
+    offset = abs(offset)
+    return f"{sign}{offset // 60:02d}{offset % 60:02d}"
+
+
+class WorktreeCommitter:
+    def __init__(self, dir=".", source=None):
+        # 指定 source 时，计划中 source 下的路径映射到 dir 下，用于在独立的 worktree 中提交
+        self.dir = dir
+        self.source = source
+        self.base = git.get_head_hash(dir)
+
+    def _target(self, file_path):
+        if self.source is None:
+            return file_path
+        return os.path.join(self.dir, os.path.relpath(os.path.abspath(file_path), self.source))
+
+    def commit(self, changes, message, t):
+        with profiler.span("commit", "commit", files=len(changes)):
+            for p in changes:
+                if "restore" in p:
+                    # 还原项直接写回原始 blob 的字节
+                    data = git.get_blob(p["restore"], self.dir)
+                else:
+                    data = p["new_content"].encode("utf-8")
+                with open(self._target(p["file_path"]), 'wb') as f:
+                    f.write(data)
+                profiler.count("bytes_written", len(data))
+            git.add_all(self.dir)
+            git.commit_with_time(message, t, self.dir)
+
+    def finish(self):
+        return git.get_head_hash(self.dir)
+
+    def abort(self):
+        # 丢弃已经写入的提交，恢复到开始前的状态
+        git.reset_hard(self.base, self.dir)
+
+
+# 通过单个 git fast-import 进程直接写入对象库，不触碰工作区和索引，最后统一更新引用
+class FastImportCommitter:
+    def __init__(self, ref, parent, paths, dir="."):
+        self.ref = ref
+        self.head = parent
+        self.root = os.path.abspath(git.get_toplevel(dir))
+        self.ident = git.get_committer_ident(dir)
+        self.originals = git.ls_tree(parent, [self._relative(p) for p in paths], self.root)
+        self.mark = 0
+        self.process = git.popen(["git", "fast-import", "--quiet", "--date-format=raw"], self.root, stdin=PIPE)
+
+    def _relative(self, file_path):
+        return os.path.relpath(os.path.abspath(file_path), self.root).replace(os.sep, "/")
+
+    def _write_blob(self, data):
+        self.mark += 1
+        self._write(b"blob\nmark :%d\ndata %d\n" % (self.mark, len(data)) + data + b"\n")
+        return f":{self.mark}"
+
+    def _write(self, data):
+        profiler.count("bytes_written", len(data))
+        self.process.stdin.write(data)
+
+    def commit(self, changes, message, t):
+        with profiler.span("commit", "commit", files=len(changes)):
+            self._commit(changes, message, t)
+
+    def _commit(self, changes, message, t):
+        files = {}
+        for p in changes:
+            path = self._relative(p["file_path"])
+            if "restore" in p:
+                # 还原项直接指回原始 blob
+                files[path] = p["restore"]
+            else:
+                files[path] = p["new_content"].encode("utf-8")
+
+        modifies = []
+        for path, data in files.items():
+            mode, original = self.originals.get(path, ("100644", None))
+            if isinstance(data, bytes):
+                modifies.append(f"M {mode} {self._write_blob(data)} {path}\n")
+            else:
+                modifies.append(f"M {mode} {data} {path}\n")
+
+        self.mark += 1
+        signature = f"{self.ident} {t} {_format_tz(t)}"
+        message = message.encode("utf-8")
+        stream = f"commit {self.ref}\nmark :{self.mark}\n".encode("utf-8")
+        stream += f"author {signature}\ncommitter {signature}\n".encode("utf-8")
+        stream += b"data %d\n" % len(message) + message + b"\n"
+        stream += f"from {self.head}\n".encode("utf-8")
+        stream += "".join(modifies).encode("utf-8") + b"\n"
+        self._write(stream)
+        self.head = f":{self.mark}"
+
+    def finish(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise Exception("git fast-import 失败")
+        return git.rev_parse(self.ref, self.root)
+
+    def abort(self):
+        # 直接结束进程而不关闭输入，fast-import 不会更新任何引用
+        self.process.kill()
+        self.process.wait()
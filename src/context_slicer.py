@@ -0,0 +1,118 @@
+import ast
+import random
+from typing import List, Tuple, Optional
+
+MIN_REGION_LINES = 5
+MAX_REGION_LINES = 150
+CONTEXT_LINES = 10
+
+
+def _python_regions(content: str) -> List[Tuple[int, int, Optional[int]]]:
+    # 返回 (起始行, 结束行, 父区域序号)，行号从 0 开始，结束行不包含
+    tree = ast.parse(content)
+    regions = []
+
+    def visit(body, parent):
+        for node in body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list]) - 1
+                regions.append((start, node.end_lineno, parent))
+                visit(node.body, len(regions) - 1)
+
+    visit(tree.body, None)
+    return regions
+
+
+def _brace_regions(lines: List[str]) -> List[Tuple[int, int, Optional[int]]]:
+    # 轻量的花括号扫描，跳过字符串和注释，不做完整语法分析
+    regions = []
+    stack = []
+    in_block_comment = False
+    for number, line in enumerate(lines):
+        quote = None
+        i = 0
+        while i < len(line):
+            char = line[i]
+            if in_block_comment:
+                if line.startswith("*/", i):
+                    in_block_comment = False
+                    i += 1
+            elif quote is not None:
+                if char == "\\":
+                    i += 1
+                elif char == quote:
+                    quote = None
+            elif line.startswith("//", i):
+                break
+            elif line.startswith("/*", i):
+                in_block_comment = True
+                i += 1
+            elif char in "\"'`":
+                quote = char
+            elif char == "{":
+                stack.append((number, len(regions)))
+                regions.append(None)
+            elif char == "}" and len(stack) > 0:
+                start, index = stack.pop()
+                parent = stack[-1][1] if len(stack) > 0 else None
+                regions[index] = (_signature_start(lines, start), number + 1, parent)
+            i += 1
+
+    return [region for region in regions if region is not None]
+
+
+def _signature_start(lines: List[str], number: int) -> int:
+    # 向上包含函数签名、注解等，直到空行或上一条语句结束
+    while number > 0:
+        previous = lines[number - 1].strip()
+        if len(previous) == 0 or previous.endswith((";", "}", "{")):
+            break
+        number -= 1
+    return number
+
+
+def find_regions(content: str, language: str) -> List[Tuple[int, int]]:
+    lines = content.splitlines(keepends=True)
+    try:
+        if language == "python":
+            regions = _python_regions(content)
+        else:
+            regions = _brace_regions(lines)
+    except (SyntaxError, ValueError):
+        return []
+
+    # 只保留能放进上下文的最外层区域
+    fits = [MIN_REGION_LINES <= end - start <= MAX_REGION_LINES for start, end, _ in regions]
+    result = []
+    for i, (start, end, parent) in enumerate(regions):
+        if not fits[i]:
+            continue
+        outermost = True
+        while parent is not None:
+            if fits[parent]:
+                outermost = False
+                break
+            parent = regions[parent][2]
+        if outermost:
+            result.append((start, end))
+    return result
+
+
+def slice_content(content: str, language: str) -> Optional[Tuple[str, str, str, int, int]]:
+    # 选择一个函数或类区域，连同前后少量上下文返回 (前缀, 片段, 后缀, 起始行, 结束行)
+    regions = find_regions(content, language)
+    if len(regions) == 0:
+        return None
+
+    start, end = random.choice(regions)
+    lines = content.splitlines(keepends=True)
+    start = max(0, start - CONTEXT_LINES)
+    end = min(len(lines), end + CONTEXT_LINES)
+    return "".join(lines[:start]), "".join(lines[start:end]), "".join(lines[end:]), start + 1, end
+
+
+def splice(prefix: str, window: str, modified: str, suffix: str) -> str:
+    # 模型经常去掉片段末尾的换行，拼接时按原片段补回
+    if window.endswith("\n") and not modified.endswith("\n") and len(suffix) > 0:
+        modified += "\r\n" if window.endswith("\r\n") else "\n"
+    return prefix + modified + suffix
@@ -0,0 +1,17 @@
+from typing import List, Dict, Tuple
+
+
+def apply_edits(content: str, edits: List[Dict]) -> Tuple[str, List[int]]:
+    # 按顺序应用 search/replace 修改，search 必须在当前内容中唯一出现，返回新内容和失败的修改序号
+    failed = []
+    for i, edit in enumerate(edits):
+        search = edit.get("search") if isinstance(edit, dict) else None
+        replace = edit.get("replace") if isinstance(edit, dict) else None
+        if not isinstance(search, str) or not isinstance(replace, str) or len(search) == 0:
+            failed.append(i)
+            continue
+        if content.count(search) != 1:
+            failed.append(i)
+            continue
+        content = content.replace(search, replace, 1)
+    return content, failed
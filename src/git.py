@@ -1,9 +1,130 @@
-from subprocess import check_output
+import atexit
+import os
+import threading
+from subprocess import check_output, CalledProcessError, Popen, PIPE, DEVNULL
+
+import profiler
+
+
+def _run(command, dir=".", **kwargs):
+    # 所有一次性的 git 子进程都经过这里，启用性能分析时统计数量和耗时
+    name = " ".join((command.split() if isinstance(command, str) else command)[:2])
+    profiler.count("subprocesses")
+    with profiler.span(name, "git"):
+        return check_output(command, cwd=dir, encoding="utf-8", **kwargs)
+
+
+def popen(command, dir=".", **kwargs):
+    # 常驻的 git 进程（cat-file、fast-import）也计入子进程数量
+    profiler.count("subprocesses")
+    return Popen(command, cwd=dir, **kwargs)
+
+
+# 在整个运行期间保持 git cat-file --batch/--batch-check 进程常驻，通过管道回答查询
+class GitSession:
+    def __init__(self, dir="."):
+        self.dir = dir
+        self.lock = threading.Lock()
+        self.avoided = 0
+        self.git_dir = os.path.join(dir, _run("git rev-parse --git-dir", dir, shell=True).strip())
+        self.batch = popen(["git", "cat-file", "--batch"], dir, stdin=PIPE, stdout=PIPE, stderr=DEVNULL)
+        self.batch_check = popen(["git", "cat-file", "--batch-check"], dir, stdin=PIPE, stdout=PIPE,
+                                  stderr=DEVNULL)
+
+    def _query(self, process, rev):
+        process.stdin.write(rev.encode("utf-8") + b"\n")
+        process.stdin.flush()
+        header = process.stdout.readline().decode("utf-8").split()
+        if len(header) != 3:
+            return None
+        return header
+
+    def check(self, rev):
+        with self.lock:
+            self.avoided += 1
+            return self._query(self.batch_check, rev)
+
+    def read(self, rev):
+        with self.lock:
+            self.avoided += 1
+            header = self._query(self.batch, rev)
+            if header is None:
+                return None
+            data = self.batch.stdout.read(int(header[2]) + 1)[:-1]
+            return header[1], data
+
+    def get_hash(self, rev):
+        header = self.check(rev)
+        if header is None:
+            raise CalledProcessError(128, f"git rev-parse {rev}")
+        return header[0]
+
+    def get_commit_time(self, commit):
+        result = self.read(commit)
+        if result is None or result[0] != "commit":
+            raise CalledProcessError(128, f"git show {commit}")
+        for line in result[1].decode("utf-8", errors="replace").split("\n"):
+            if line.startswith("author "):
+                return line.rsplit(" ", 2)[1]
+            if len(line) == 0:
+                break
+        raise CalledProcessError(128, f"git show {commit}")
+
+    def get_blob(self, rev):
+        result = self.read(rev)
+        if result is None or result[0] != "blob":
+            raise CalledProcessError(128, f"git cat-file blob {rev}")
+        return result[1]
+
+    def get_branch_name(self):
+        with self.lock:
+            self.avoided += 1
+            with open(os.path.join(self.git_dir, "HEAD"), encoding="utf-8") as f:
+                head = f.read().strip()
+        if head.startswith("ref: refs/heads/"):
+            return head[len("ref: refs/heads/"):]
+        return "HEAD"
+
+    def close(self):
+        for process in (self.batch, self.batch_check):
+            if process.poll() is None:
+                process.stdin.close()
+                process.wait()
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(dir="."):
+    key = os.path.abspath(dir)
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = GitSession(dir)
+        return _sessions[key]
+
+
+@atexit.register
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def get_avoided_subprocesses():
+    return sum(session.avoided for session in _sessions.values())
+
+
+def close_session(dir="."):
+    with _sessions_lock:
+        session = _sessions.pop(os.path.abspath(dir), None)
+    if session is not None:
+        session.close()
 
 
 def get_commit_time(commit, dir="."):
-    command = f"git show --no-patch --date=unix --format=%ad {commit}"
-    return check_output(command, cwd=dir, encoding="utf-8", shell=True).strip()
+    return get_session(dir).get_commit_time(commit)
 
 
 def get_head_time(dir="."):
@@ -11,60 +132,181 @@ def get_head_time(dir="."):
 
 
 def get_head_hash(dir="."):
-    command = "git rev-parse HEAD"
-    return check_output(command, cwd=dir, encoding="utf-8", shell=True).strip()
+    return get_session(dir).get_hash("HEAD")
+
+
+def get_blob(rev, dir="."):
+    return get_session(dir).get_blob(rev)
 
 
 def add_all(dir="."):
     command = "git add -A"
-    return check_output(command, cwd=dir, encoding="utf-8", shell=True)
+    return _run(command, dir, shell=True)
 
 
 def commit_with_time(message, time, dir="."):
     command = f'git commit --message="{message}" --date="{time}"'
-    return check_output(command, cwd=dir, encoding="utf-8", shell=True)
-
-
-def commit_amend_with_time(time, dir="."):
-    command = f'git commit --amend --no-edit --date="{time}"'
-    return check_output(command, cwd=dir, encoding="utf-8", shell=True)
+    return _run(command, dir, shell=True)
 
 
 def check_dirty(dir="."):
     command = "git status --porcelain --ignore-submodules=dirty"
-    return len(check_output(command, cwd=dir, encoding="utf-8", shell=True).strip()) > 0
+    return len(_run(command, dir, shell=True).strip()) > 0
 
 
 def get_branch_name(dir="."):
-    command = "git rev-parse --abbrev-ref HEAD"
-    return check_output(command, cwd=dir, encoding="utf-8", shell=True).strip()
+    return get_session(dir).get_branch_name()
 
 
 def new_branch(branch, commit, dir="."):
     command = f"git checkout -b {branch} {commit}"
-    return check_output(command, cwd=dir, encoding="utf-8", shell=True)
+    return _run(command, dir, shell=True)
 
 
 def delete_branch(branch, dir="."):
     command = f"git branch -D {branch}"
-    return check_output(command, cwd=dir, encoding="utf-8", shell=True)
+    return _run(command, dir, shell=True)
 
 
 def checkout(commit, dir="."):
     command = f"git checkout {commit}"
-    return check_output(command, cwd=dir, encoding="utf-8", shell=True)
+    return _run(command, dir, shell=True)
 
 
 def rebase(branch, target, dir="."):
     command = f"git rebase {branch} {target}"
-    return check_output(command, cwd=dir, encoding="utf-8", shell=True)
+    return _run(command, dir, shell=True)
+
+
+def is_ancestor(ancestor, commit, dir="."):
+    command = ["git", "merge-base", "--is-ancestor", ancestor, commit]
+    try:
+        _run(command, dir)
+        return True
+    except CalledProcessError as e:
+        if e.returncode == 1:
+            return False
+        raise
+
+
+def rev_list_parents(old, new, dir="."):
+    # 按拓扑顺序从旧到新列出 old..new 中的提交及其父提交
+    command = ["git", "rev-list", "--reverse", "--topo-order", "--parents", f"{old}..{new}"]
+    output = _run(command, dir)
+    return [(line.split()[0], line.split()[1:]) for line in output.splitlines() if len(line) > 0]
+
+
+def hash_objects(object_type, paths, dir="."):
+    if len(paths) == 0:
+        return []
+    command = ["git", "hash-object", "-t", object_type, "-w", "--stdin-paths"]
+    return _run(command, dir, input="\n".join(paths) + "\n").split()
+
+
+def update_ref(ref, new, old, dir="."):
+    command = ["git", "update-ref", "-m", "commit-mirage", ref, new, old]
+    return _run(command, dir)
+
+
+def delete_ref(ref, dir="."):
+    command = ["git", "update-ref", "-d", ref]
+    return _run(command, dir)
+
+
+def add_worktree(path, commit, dir="."):
+    command = ["git", "worktree", "add", "--detach", path, commit]
+    return _run(command, dir, stderr=DEVNULL)
+
+
+def remove_worktree(path, dir="."):
+    close_session(path)
+    command = ["git", "worktree", "remove", "--force", path]
+    return _run(command, dir)
+
+
+def rebase_onto(new_base, upstream, tip, dir="."):
+    command = ["git", "rebase", "--onto", new_base, upstream, tip]
+    return _run(command, dir)
+
+
+def reset_hard(commit, dir="."):
+    command = f"git reset --hard {commit}"
+    return _run(command, dir, shell=True)
+
+
+def get_toplevel(dir="."):
+    command = "git rev-parse --show-toplevel"
+    return _run(command, dir, shell=True).strip()
+
+
+def get_symbolic_ref(dir="."):
+    command = "git symbolic-ref -q HEAD"
+    try:
+        return _run(command, dir, shell=True).strip()
+    except CalledProcessError:
+        return None
+
+
+def get_committer_ident(dir="."):
+    command = "git var GIT_COMMITTER_IDENT"
+    ident = _run(command, dir, shell=True).strip()
+    return ident.rsplit(" ", 2)[0]
+
+
+def rev_parse(rev, dir="."):
+    return get_session(dir).get_hash(rev)
+
+
+def ls_tree(commit, paths, dir="."):
+    output = _run(["git", "ls-tree", "-z", "--full-tree", commit, "--", *paths], dir)
+    entries = {}
+    for line in output.split("\0"):
+        if len(line) == 0:
+            continue
+        info, path = line.split("\t", 1)
+        mode, _, sha = info.split(" ")
+        entries[path] = (mode, sha)
+    return entries
+
+
+def ls_files(dir="."):
+    command = "git ls-files -z --cached --others --exclude-standard"
+    output = _run(command, dir, shell=True)
+    return [path for path in output.split("\0") if len(path) != 0]
+
+
+def get_common_dir(dir="."):
+    command = "git rev-parse --git-common-dir"
+    return os.path.join(dir, _run(command, dir, shell=True).strip())
+
 
+def ls_blob_shas(dir="."):
+    # 返回工作区中未修改的已跟踪文件的 blob SHA
+    command = "git ls-files -s -z"
+    output = _run(command, dir, shell=True)
+    shas = {}
+    for line in output.split("\0"):
+        if len(line) == 0:
+            continue
+        info, path = line.split("\t", 1)
+        shas[path] = info.split(" ")[1]
 
-def diff(old, new, dir="."):
-    command = f"git diff {old} {new}"
-    return check_output(command, cwd=dir, encoding="utf-8", shell=True)
+    command = "git diff-files --name-only --relative -z"
+    for path in _run(command, dir, shell=True).split("\0"):
+        shas.pop(path, None)
+    return shas
 
 
-def apply_reverse(patch, dir="."):
-    command = "git apply -R"
-    return check_output(command, input=patch, cwd=dir, encoding="utf-8", shell=True)
+def ls_tree_files(commit, dir="."):
+    # 返回 (path, mode, sha, size)，路径相对于 dir
+    command = f"git ls-tree -r -l -z {commit}"
+    output = _run(command, dir, shell=True)
+    files = []
+    for line in output.split("\0"):
+        if len(line) == 0:
+            continue
+        info, path = line.split("\t", 1)
+        mode, type, sha, size = info.split()
+        if type == "blob":
+            files.append((path, mode, sha, int(size)))
+    return files
@@ -0,0 +1,113 @@
+import json
+import re
+from typing import Any, Dict, Iterable, Optional
+
+
+class SchemaMismatch(Exception):
+    pass
+
+
+def parse_json(text: str) -> Any:
+    try:
+        return json.loads(text)
+    except ValueError:
+        json_match = re.search(r'```(?:json)?\s*(\{.*})\s*```', text, re.DOTALL)
+        if json_match:
+            return json.loads(json_match.group(1))
+        # 流式输出在对象结束后提前停止时，结尾可能残留不完整的代码块标记
+        start = text.find("{")
+        end = text.rfind("}")
+        if start != -1 and end > start:
+            return json.loads(text[start:end + 1])
+        raise
+
+
+class IncrementalJSONValidator:
+    # 逐块检查流式输出是否是包含预期字段的 JSON 对象，一旦明显不符合就抛出 SchemaMismatch。
+    # 与非流式的检查一致，只在输出不是对象或缺少预期字段时中止，允许额外的字段
+    def __init__(self, expected_keys: Iterable[str]):
+        self.expected_keys = set(expected_keys)
+        self.prefix = ""
+        self.started = False
+        self.complete = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.expect_key = False
+        self.key = None
+        self.keys = set()
+
+    def feed(self, chunk: str):
+        if not self.started:
+            chunk = self._skip_prefix(chunk)
+            if chunk is None:
+                return
+
+        for char in chunk:
+            if self.complete:
+                return
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.key is not None:
+                        self.keys.add(self.key)
+                        self.key = None
+                elif self.key is not None:
+                    self.key += char
+                continue
+
+            if char == '"':
+                self.in_string = True
+                if self.depth == 1 and self.expect_key:
+                    self.key = ""
+                    self.expect_key = False
+            elif char in "{[":
+                self.depth += 1
+                if self.depth == 1:
+                    self.expect_key = True
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.complete = True
+                    missing = self.expected_keys - self.keys
+                    if missing:
+                        raise SchemaMismatch(f"缺少字段: {', '.join(sorted(missing))}")
+            elif self.depth == 1 and char == ",":
+                self.expect_key = True
+            elif self.depth == 1 and self.expect_key and not char.isspace():
+                raise SchemaMismatch(f"字段名位置出现意外字符: {char}")
+
+    def _skip_prefix(self, chunk: str) -> Optional[str]:
+        # 允许以 ```json 代码块开头
+        self.prefix += chunk
+        stripped = self.prefix.lstrip()
+        if len(stripped) == 0:
+            return None
+        if stripped.startswith("{"):
+            self.started = True
+            return stripped
+        if stripped.startswith("`"):
+            if "\n" not in stripped:
+                if not re.fullmatch(r"`{1,3}[a-zA-Z]*", stripped):
+                    raise SchemaMismatch("响应不是 JSON 对象")
+                return None
+            fence, rest = stripped.split("\n", 1)
+            if not re.fullmatch(r"```[a-zA-Z]*\s*", fence):
+                raise SchemaMismatch("响应不是 JSON 对象")
+            self.prefix = rest
+            return self._skip_prefix("")
+        raise SchemaMismatch("响应不是 JSON 对象")
+
+    def snapshot(self) -> Dict[str, Any]:
+        state = dict(self.__dict__)
+        state["keys"] = set(self.keys)
+        return state
+
+    def restore(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self.keys = set(state["keys"])
@@ -0,0 +1,38 @@
+import hashlib
+import os
+
+import git
+
+
+def blob_sha(data, original=None):
+    # 与原始 blob 使用相同的哈希算法（SHA-1 或 SHA-256 仓库）
+    algorithm = "sha256" if original is not None and len(original) == 64 else "sha1"
+    return hashlib.new(algorithm, b"blob %d\0" % len(data) + data).hexdigest()
+
+
+# 在内存中跟踪计划中每个文件的预期内容，最后一个提交之前找出不能恢复原样的文件
+class Ledger:
+    def __init__(self, paths, base, dir="."):
+        self.root = os.path.abspath(git.get_toplevel(dir))
+        self.originals = git.ls_tree(base, [self._relative(p) for p in paths], self.root)
+        self.expected = {}
+
+    def _relative(self, file_path):
+        return os.path.relpath(os.path.abspath(file_path), self.root).replace(os.sep, "/")
+
+    def record(self, changes):
+        for p in changes:
+            path = self._relative(p["file_path"])
+            if "restore" in p:
+                self.expected[path] = p["restore"]
+            else:
+                original = self.originals.get(path, (None, None))[1]
+                self.expected[path] = blob_sha(p["new_content"].encode("utf-8"), original)
+
+    def repairs(self):
+        # 对最终内容与原始 blob 不一致的文件，生成直接写回原始字节的还原项
+        items = []
+        for path, sha in self.expected.items():
+            if path in self.originals and self.originals[path][1] != sha:
+                items.append({"file_path": os.path.join(self.root, path), "restore": self.originals[path][1]})
+        return items
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from utils import print_err
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_AGE = 30 * 24 * 3600
+
+
+class LLMCache:
+    # 以 (provider, model, prompt) 哈希为键的磁盘响应缓存，按最近使用时间淘汰
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES, max_age: float = DEFAULT_MAX_AGE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.total_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        self.evict()
+
+    def key(self, provider: str, model: str, prompt: str) -> str:
+        data = json.dumps([provider, model, prompt], ensure_ascii=False)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            if time.time() - os.stat(path).st_mtime > self.max_age:
+                os.remove(path)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                response = json.load(f)["response"]
+            # 更新修改时间，作为 LRU 的最近使用时间
+            os.utime(path)
+            return response
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print_err(f"LLM 缓存文件损坏，已忽略: {path}: {e}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def put(self, key: str, response: str):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({"response": response}, f, ensure_ascii=False)
+            size = os.path.getsize(temp_path)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print_err(f"无法写入 LLM 缓存: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        with self.lock:
+            self.total_bytes += size
+            over = self.total_bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self):
+        with self.lock:
+            now = time.time()
+            files = []
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    if not name.endswith(".json"):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    if now - stat.st_mtime > self.max_age:
+                        os.remove(path)
+                    else:
+                        files.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in files)
+            files.sort()
+            for _, size, path in files:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+            self.total_bytes = total
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_llm_cache(directory: Optional[str]) -> Optional[LLMCache]:
+    if not directory:
+        return None
+    with _caches_lock:
+        if directory not in _caches:
+            _caches[directory] = LLMCache(directory)
+        return _caches[directory]
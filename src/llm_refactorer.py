@@ -1,49 +1,20 @@
 import json
 import os
-from typing import List, Dict, Any
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Iterator, Callable
 
+import git
+import profiler
 from call_llm import call_llm
+from context_slicer import slice_content, splice
+from edits import apply_edits
+from json_stream import parse_json
 
 
-class LLMRefactorer:
-    def __init__(self, llm_config: Dict[str, Any]):
-        self.llm_config = llm_config
-
-    def create_refactor_plan(self, target_files: List[Dict], dir) -> List[Dict]:
-        refactor_plan = []
-
-        for i, file_target in enumerate(target_files):
-            file_path = os.path.join(dir, file_target["file_path"])
-
-            with open(file_path, 'r', encoding='utf-8') as f:
-                original_content = f.read()
-
-            file_commits = self._generate_file_commits(
-                str(file_path),
-                original_content,
-                file_target,
-                commit_prefix=f"[File {i + 1}]"
-            )
-
-            refactor_plan.extend(file_commits)
-
-        return refactor_plan
-
-    def _generate_file_commits(self, file_path: str, content: str,
-                               target_info: Dict, commit_prefix: str) -> List[Dict]:
-        add_prompt = f"""
-        你是一个资深的软件开发者。我需要你为以下代码添加一些有用的功能，但这些功能稍后会被删除。
-
-        文件路径: {file_path}
-        修改策略: {target_info.get('modification_strategy', '添加辅助功能')}
-        建议操作: {target_info.get('operations', [])}
-
-        原始代码:
-        ```
-        {content}
-        ```
-
-        要求：
+# 单个文件和批量的添加请求共用的要求，以 f-string 中缩进后的位置开头
+ADD_REQUIREMENTS = """要求：
         1. 添加1个或2个有意义的功能，例如：
            - 新的辅助函数
            - 日志记录
@@ -57,37 +28,439 @@ class LLMRefactorer:
         6. 不要在文件末尾添加换行符
         7. 不要删除文件末尾已有的换行符
         8. 不要添加任何新的注释
-        9. 不要删除任何已有的注释
+        9. 不要删除任何已有的注释"""
+
+REMOVE_REQUIREMENTS = """要求：
+        1. 精确删除之前添加的功能
+        2. 确保代码完全回到原始状态
+        3. 不要遗留任何添加的代码"""
 
+FULL_OUTPUT_FORMAT = """
         请返回修改后的完整代码和简短的变更说明，请直接以JSON格式返回结果，不需要其他说明，确保返回结果能被Python的json.loads()解析，不需要返回markdown代码块：
 
         格式：
-        {{
+        {
             "modified_code": "完整的修改后代码",
             "commit_message": "精简的英文Git提交信息，不需要任何前缀"
-        }}
+        }"""
+
+EDITS_OUTPUT_FORMAT = """
+        不要返回完整代码，只返回修改列表。每个修改把原始代码中的一个片段 search 替换为 replace：
+        - search 必须从原始代码中逐字复制，包括缩进和换行，并且在原始代码中只出现一次
+        - search 尽量短，只包含定位所需的几行
+        - 添加新代码时，把插入位置附近的几行作为 search，在 replace 中保留这几行并加入新代码
+
+        请直接以JSON格式返回结果，不需要其他说明，确保返回结果能被Python的json.loads()解析，不需要返回markdown代码块：
+
+        格式：
+        {
+            "edits": [
+                {"search": "原始代码片段", "replace": "替换后的代码片段"}
+            ],
+            "commit_message": "精简的英文Git提交信息，不需要任何前缀"
+        }"""
+
+BATCH_FULL_OUTPUT_FORMAT = """
+        请为每个文件返回修改后的完整代码和简短的变更说明，请直接以JSON格式返回结果，不需要其他说明，确保返回结果能被Python的json.loads()解析，不需要返回markdown代码块：
+
+        格式：
+        {
+            "results": [
+                {
+                    "file_path": "文件路径",
+                    "modified_code": "完整的修改后代码",
+                    "commit_message": "精简的英文Git提交信息，不需要任何前缀"
+                }
+            ]
+        }"""
+
+BATCH_EDITS_OUTPUT_FORMAT = """
+        不要返回完整代码，只为每个文件返回修改列表。每个修改把该文件原始代码中的一个片段 search 替换为 replace：
+        - search 必须从该文件的原始代码中逐字复制，包括缩进和换行，并且在该文件中只出现一次
+        - search 尽量短，只包含定位所需的几行
+        - 添加新代码时，把插入位置附近的几行作为 search，在 replace 中保留这几行并加入新代码
+
+        请直接以JSON格式返回结果，不需要其他说明，确保返回结果能被Python的json.loads()解析，不需要返回markdown代码块：
+
+        格式：
+        {
+            "results": [
+                {
+                    "file_path": "文件路径",
+                    "edits": [
+                        {"search": "原始代码片段", "replace": "替换后的代码片段"}
+                    ],
+                    "commit_message": "精简的英文Git提交信息，不需要任何前缀"
+                }
+            ]
+        }"""
+
+BATCH_REMOVE_OUTPUT_FORMAT = """
+        请为每个文件返回删除功能后的完整代码，请直接以JSON格式返回结果，不需要其他说明，确保返回结果能被Python的json.loads()解析，不需要返回markdown代码块：
+
+        格式：
+        {
+            "results": [
+                {
+                    "file_path": "文件路径",
+                    "modified_code": "删除功能后的完整代码",
+                    "commit_message": "精简的英文Git提交信息，不需要任何前缀，尽量使用Update去描述，不要使用Delete/Remove/Revert描述"
+                }
+            ]
+        }"""
+
+FULL_OUTPUT_KEYS = ("modified_code", "commit_message")
+EDITS_OUTPUT_KEYS = ("edits", "commit_message")
+MAX_EDIT_RETRIES = 2
+MAX_BATCH_FILES = 8
+REVERT_MESSAGE_BATCH = 8
+
+
+class LLMRefactorer:
+    def __init__(self, llm_config: Dict[str, Any], concurrency: int = 1, local_revert: bool = False,
+                 edit_format: str = "full", batch_tokens: int = 0, slice_lines: int = 0):
+        self.llm_config = llm_config
+        self.concurrency = concurrency
+        self.local_revert = local_revert
+        self.edit_format = edit_format
+        self.batch_tokens = batch_tokens
+        self.slice_lines = slice_lines
+
+    def _prepare(self, target_files: List[Dict], dir, rev: Optional[str]):
+        file_paths = [os.path.join(dir, file_target["file_path"]) for file_target in target_files]
+        with profiler.span("read_originals", "plan", files=len(target_files)):
+            originals = [
+                self._read_original(file_path, file_target["file_path"], dir, rev)
+                for file_path, file_target in zip(file_paths, target_files)
+            ]
+        return file_paths, originals, self._pack_batches(originals)
+
+    def create_refactor_plan(self, target_files: List[Dict], dir, rev: Optional[str] = None,
+                             done: Optional[Dict[int, List[Dict]]] = None,
+                             on_file: Optional[Callable[[int, List[Dict]], None]] = None) -> List[Dict]:
+        file_paths, originals, groups = self._prepare(target_files, dir, rev)
+
+        # 并发生成时按原始顺序收集结果，保证提交计划确定
+        if self.concurrency > 1:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                group_results = list(executor.map(
+                    lambda group: self._plan_group(group, file_paths, originals, target_files, done, on_file),
+                    groups
+                ))
+        else:
+            group_results = [
+                self._plan_group(group, file_paths, originals, target_files, done, on_file) for group in groups
+            ]
+
+        by_index = {}
+        for group_result in group_results:
+            by_index.update(group_result)
+        results = [by_index[i] for i in range(len(target_files))]
+
+        # 本地还原模式下，所有还原提交的提交信息合并为一次请求生成
+        if self.local_revert:
+            self._set_revert_messages(results)
+
+        refactor_plan = []
+        for file_commits in results:
+            refactor_plan.extend(file_commits)
+
+        return refactor_plan
+
+    def iter_refactor_plan(self, target_files: List[Dict], dir, rev: Optional[str] = None,
+                           done: Optional[Dict[int, List[Dict]]] = None,
+                           on_file: Optional[Callable[[int, List[Dict]], None]] = None,
+                           stop: Optional[threading.Event] = None) -> Iterator[List[Dict]]:
+        # 按原始顺序逐个产出每个文件的 [添加, 删除]。只有有限数量的组在后台进行，
+        # 调用方不再取结果时生成器暂停，不会继续发出新的请求；设置 stop 或关闭生成器时取消尚未开始的请求
+        file_paths, originals, groups = self._prepare(target_files, dir, rev)
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        futures = deque()
+        submitted = 0
+        by_index = {}
+        next_index = 0
+        waiting = []
+        try:
+            while next_index < len(target_files):
+                while submitted < len(groups) and len(futures) < 2 * max(1, self.concurrency):
+                    futures.append(executor.submit(self._plan_group, groups[submitted], file_paths, originals,
+                                                   target_files, done, on_file))
+                    submitted += 1
+                by_index.update(futures.popleft().result())
+                if stop is not None and stop.is_set():
+                    return
+
+                ready = []
+                while next_index in by_index:
+                    ready.append(by_index.pop(next_index))
+                    next_index += 1
+                if not self.local_revert:
+                    yield from ready
+                    continue
+
+                # 本地还原模式下，跨组攒够一批后再合并生成还原提交信息
+                waiting.extend(ready)
+                if len(waiting) >= REVERT_MESSAGE_BATCH or next_index == len(target_files):
+                    self._set_revert_messages(waiting)
+                    yield from waiting
+                    waiting = []
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _estimate_tokens(self, content: str) -> int:
+        # 粗略估算：输入约 4 个字符一个 token，完整代码模式下输出再回显一遍
+        tokens = len(content) // 4 + 1
+        if self.edit_format == "full":
+            tokens *= 2
+        return tokens
+
+    def _pack_batches(self, originals: List[str]) -> List[List[int]]:
+        # 将小文件按 token 预算装入同一个请求，大文件单独请求
+        if self.batch_tokens <= 0:
+            return [[i] for i in range(len(originals))]
+
+        groups = []
+        current = []
+        current_tokens = 0
+        for i, content in enumerate(originals):
+            tokens = self._estimate_tokens(content)
+            # 需要切片的大文件单独请求，不把整个文件放进批量请求
+            if tokens > self.batch_tokens // 2 or self._needs_slice(content):
+                groups.append([i])
+                continue
+            if current_tokens + tokens > self.batch_tokens or len(current) >= MAX_BATCH_FILES:
+                groups.append(current)
+                current = []
+                current_tokens = 0
+            current.append(i)
+            current_tokens += tokens
+
+        if len(current) > 0:
+            groups.append(current)
+        return groups
+
+    def _plan_group(self, group: List[int], file_paths: List[str], originals: List[str],
+                    target_files: List[Dict], done: Optional[Dict[int, List[Dict]]] = None,
+                    on_file: Optional[Callable[[int, List[Dict]], None]] = None) -> Dict[int, List[Dict]]:
+        # 续跑时已经生成过的文件直接复用
+        if done is not None and all(i in done for i in group):
+            return {i: done[i] for i in group}
+
+        with profiler.span("plan_group", "plan", files=[target_files[i]["file_path"] for i in group]):
+            if len(group) == 1:
+                i = group[0]
+                group_result = {i: self._generate_file_commits(file_paths[i], originals[i], target_files[i],
+                                                               commit_prefix=f"[File {i + 1}]")}
+            else:
+                group_result = self._plan_batch(group, file_paths, originals, target_files)
+
+        if on_file is not None:
+            for i in group:
+                on_file(i, group_result[i])
+        return group_result
+
+    def _plan_batch(self, group: List[int], file_paths: List[str], originals: List[str],
+                    target_files: List[Dict]) -> Dict[int, List[Dict]]:
+        files = []
+        for i in group:
+            files.append(f"""
+        文件 {len(files) + 1}
+        文件路径: {file_paths[i]}
+        修改策略: {target_files[i].get('modification_strategy', '添加辅助功能')}
+        建议操作: {target_files[i].get('operations', [])}
+
+        原始代码:
+        ```
+        {originals[i]}
+        ```
+        """)
+
+        if self.edit_format == "edits":
+            output_format = BATCH_EDITS_OUTPUT_FORMAT
+        else:
+            output_format = BATCH_FULL_OUTPUT_FORMAT
+
+        prompt = f"""
+        你是一个资深的软件开发者。我需要你为以下{len(group)}个文件分别添加一些有用的功能，但这些功能稍后会被删除。
+        {"".join(files)}
+        {ADD_REQUIREMENTS}
+        10. results 数组按上面的文件顺序排列，每个文件对应一项
+        {output_format}
         """
 
-        add_response = call_llm(self.llm_config, add_prompt)
-        add_result = self._parse_llm_response(add_response)
+        try:
+            entries = self._parse_llm_response(call_llm(self.llm_config, prompt, ("results",)))["results"]
+        except Exception:
+            entries = []
+        matched = self._match_batch_entries(entries, group, file_paths, target_files)
+
+        add_results = {}
+        for i in group:
+            add_result = self._batch_entry_result(matched[i], originals[i]) if i in matched else None
+            if add_result is not None:
+                add_results[i] = add_result
+
+        # 添加成功的文件的删除请求同样合并为一次；本地还原模式下不需要删除请求
+        remove_results = {}
+        if not self.local_revert and len(add_results) > 1:
+            remove_results = self._remove_batch(list(add_results), file_paths, originals, target_files, add_results)
 
-        remove_prompt = f"""
-        现在我需要你删除刚才添加的功能，让代码回到原始状态。
+        # 单个条目失败时只对该文件单独重试
+        results = {}
+        for i in group:
+            if i in remove_results:
+                results[i] = self._commit_pair(file_paths[i], add_results[i], remove_results[i])
+                continue
+            results[i] = self._generate_file_commits(file_paths[i], originals[i], target_files[i],
+                                                     commit_prefix=f"[File {i + 1}]", add_result=add_results.get(i))
+        return results
+
+    def _remove_batch(self, group: List[int], file_paths: List[str], originals: List[str],
+                      target_files: List[Dict], add_results: Dict[int, Dict]) -> Dict[int, Dict]:
+        files = []
+        for i in group:
+            files.append(f"""
+        文件 {len(files) + 1}
+        文件路径: {file_paths[i]}
+
+        原始代码:
+        ```
+        {originals[i]}
+        ```
 
         修改后的代码:
         ```
-        {add_result['modified_code']}
+        {add_results[i]['modified_code']}
         ```
+        """)
 
-        原始代码:
+        prompt = f"""
+        你是一个资深的软件开发者。我之前为以下{len(group)}个文件分别添加了一些功能，现在我需要你删除刚才添加的功能，让每个文件回到原始状态。
+        {"".join(files)}
+        {REMOVE_REQUIREMENTS}
+        4. results 数组按上面的文件顺序排列，每个文件对应一项
+        {BATCH_REMOVE_OUTPUT_FORMAT}
+        """
+
+        try:
+            entries = self._parse_llm_response(call_llm(self.llm_config, prompt, ("results",)))["results"]
+        except Exception:
+            entries = []
+
+        remove_results = {}
+        for i, entry in self._match_batch_entries(entries, group, file_paths, target_files).items():
+            if isinstance(entry.get("modified_code"), str) and isinstance(entry.get("commit_message"), str):
+                remove_results[i] = {"modified_code": entry["modified_code"], "commit_message": entry["commit_message"]}
+        return remove_results
+
+    def _match_batch_entries(self, entries, group: List[int], file_paths: List[str],
+                             target_files: List[Dict]) -> Dict[int, Dict]:
+        # 按返回的 file_path 对应到文件，不依赖条目顺序；缺失、无法识别或重复的条目都视为失败
+        names = {}
+        for i in group:
+            for name in (file_paths[i], target_files[i]["file_path"]):
+                names[os.path.normpath(name)] = i
+
+        matched = {}
+        duplicated = set()
+        for entry in entries if isinstance(entries, list) else []:
+            file_path = entry.get("file_path") if isinstance(entry, dict) else None
+            i = names.get(os.path.normpath(file_path)) if isinstance(file_path, str) else None
+            if i is None:
+                continue
+            if i in matched:
+                duplicated.add(i)
+            matched[i] = entry
+
+        for i in duplicated:
+            del matched[i]
+        return matched
+
+    def _batch_entry_result(self, entry, content: str) -> Optional[Dict]:
+        if not isinstance(entry, dict) or not isinstance(entry.get("commit_message"), str):
+            return None
+
+        if self.edit_format == "edits":
+            edits = entry.get("edits")
+            if not isinstance(edits, list):
+                return None
+            modified, failed = apply_edits(content, edits)
+            if len(failed) > 0:
+                return None
+        else:
+            modified = entry.get("modified_code")
+            if not isinstance(modified, str):
+                return None
+
+        if modified == content:
+            return None
+        return {"modified_code": modified, "commit_message": entry["commit_message"]}
+
+    def _read_original(self, file_path: str, relative_path: str, dir, rev: Optional[str]) -> str:
+        # 保留原始换行符，使还原后的内容与原文件逐字节一致
+        if rev is None:
+            with open(file_path, 'r', encoding='utf-8', newline='') as f:
+                return f.read()
+
+        return git.get_blob(f"{rev}:./{relative_path.replace(os.sep, '/')}", dir).decode("utf-8")
+
+    def _needs_slice(self, content: str) -> bool:
+        return 0 < self.slice_lines < content.count("\n") + 1
+
+    def _generate_file_commits(self, file_path: str, content: str, target_info: Dict, commit_prefix: str,
+                               add_result: Optional[Dict] = None) -> List[Dict]:
+        if add_result is not None or not self._needs_slice(content):
+            return self._generate_commits(file_path, content, target_info, commit_prefix, add_result)
+
+        # 超过切片阈值的文件绝不整体发送，找不到可用区域时该文件生成失败
+        language = "python" if file_path.endswith(".py") else "braces"
+        sliced = slice_content(content, language)
+        if sliced is None:
+            raise Exception(f"文件 {file_path} 超过 {self.slice_lines} 行，且找不到可以单独修改的函数或类区域")
+
+        # 大文件只发送一个函数或类区域及其上下文，结果拼接回完整文件
+        prefix, window, suffix, start, end = sliced
+        commits = self._generate_commits(f"{file_path} (第 {start}-{end} 行的片段)", window, target_info,
+                                         commit_prefix, None)
+        for commit in commits:
+            commit["file_path"] = file_path
+            commit["new_content"] = splice(prefix, window, commit["new_content"], suffix)
+        return commits
+
+    def _generate_commits(self, file_path: str, content: str, target_info: Dict, commit_prefix: str,
+                          add_result: Optional[Dict]) -> List[Dict]:
+        if add_result is None:
+            if self.edit_format == "edits":
+                add_result = self._generate_edits(file_path, content, target_info)
+            else:
+                add_prompt = self._add_prompt(file_path, content, target_info, FULL_OUTPUT_FORMAT)
+                add_response = call_llm(self.llm_config, add_prompt, FULL_OUTPUT_KEYS)
+                add_result = self._parse_llm_response(add_response)
+
+        # 本地还原：直接使用内存中的原始内容，提交信息稍后批量生成
+        if self.local_revert:
+            return [
+                {
+                    "file_path": file_path,
+                    "new_content": add_result['modified_code'],
+                    "commit_message": add_result['commit_message'],
+                },
+                {
+                    "file_path": file_path,
+                    "new_content": content,
+                    "commit_message": "",
+                }
+            ]
+
+        remove_prompt = [self._original_block(file_path, content), {"text": f"""
+        我之前为以上原始代码添加了一些功能，现在我需要你删除刚才添加的功能，让代码回到原始状态。
+
+        修改后的代码:
         ```
-        {content}
+        {add_result['modified_code']}
         ```
 
-        要求：
-        1. 精确删除之前添加的功能
-        2. 确保代码完全回到原始状态
-        3. 不要遗留任何添加的代码
+        {REMOVE_REQUIREMENTS}
 
         请返回删除功能后的代码，请直接以JSON格式返回结果，不需要其他说明，确保返回结果能被Python的json.loads()解析，不需要返回markdown代码块。
 
@@ -96,11 +469,14 @@ class LLMRefactorer:
             "modified_code": "删除功能后的完整代码",
             "commit_message": "精简的英文Git提交信息，不需要任何前缀，尽量使用Update去描述，不要使用Delete/Remove/Revert描述"
         }}
-        """
+        """}]
 
-        remove_response = call_llm(self.llm_config, remove_prompt)
+        remove_response = call_llm(self.llm_config, remove_prompt, FULL_OUTPUT_KEYS)
         remove_result = self._parse_llm_response(remove_response)
 
+        return self._commit_pair(file_path, add_result, remove_result)
+
+    def _commit_pair(self, file_path: str, add_result: Dict, remove_result: Dict) -> List[Dict]:
         return [
             {
                 "file_path": file_path,
@@ -114,16 +490,131 @@ class LLMRefactorer:
             }
         ]
 
-    def _parse_llm_response(self, response: str) -> Dict:
+    def _original_block(self, file_path: str, content: str) -> Dict[str, Any]:
+        # 原始代码作为稳定前缀，同一文件的添加和删除请求共享这个可缓存块
+        return {"text": f"""
+        你是一个资深的软件开发者。
+
+        文件路径: {file_path}
+
+        原始代码:
+        ```
+        {content}
+        ```
+        """, "cache": True}
+
+    def _add_prompt(self, file_path: str, content: str, target_info: Dict, output_format: str) -> List[Dict]:
+        return [self._original_block(file_path, content), {"text": f"""
+        我需要你为以上原始代码添加一些有用的功能，但这些功能稍后会被删除。
+
+        修改策略: {target_info.get('modification_strategy', '添加辅助功能')}
+        建议操作: {target_info.get('operations', [])}
+
+        {ADD_REQUIREMENTS}
+        {output_format}
+        """}]
+
+    def _generate_edits(self, file_path: str, content: str, target_info: Dict) -> Dict:
+        # 模型只返回 search/replace 修改列表，在本地对原始内容应用
+        add_prompt = self._add_prompt(file_path, content, target_info, EDITS_OUTPUT_FORMAT)
+        add_result = self._parse_llm_response(call_llm(self.llm_config, add_prompt, EDITS_OUTPUT_KEYS))
+        edits = add_result.get("edits")
+        if not isinstance(edits, list):
+            edits = []
+
+        modified, failed = apply_edits(content, edits)
+        for i in failed:
+            edit = self._retry_edit(modified, edits[i])
+            if edit is not None:
+                modified, _ = apply_edits(modified, [edit])
+
+        # 没有任何修改成功应用时退回完整代码模式
+        if modified == content:
+            add_prompt = self._add_prompt(file_path, content, target_info, FULL_OUTPUT_FORMAT)
+            return self._parse_llm_response(call_llm(self.llm_config, add_prompt, FULL_OUTPUT_KEYS))
+
+        return {
+            "modified_code": modified,
+            "commit_message": add_result.get("commit_message", ""),
+        }
+
+    def _retry_edit(self, modified: str, edit) -> Optional[Dict]:
+        for _ in range(MAX_EDIT_RETRIES):
+            prompt = f"""
+            下面这个修改无法应用到代码上：search 片段在代码中不存在或出现了不止一次。
+
+            代码:
+            ```
+            {modified}
+            ```
+
+            无法应用的修改:
+            {json.dumps(edit, indent=2, ensure_ascii=False)}
+
+            请修正这个修改，使 search 是从上面代码中逐字复制的、只出现一次的连续片段，replace 保持原来的意图。
+
+            请直接以JSON格式返回结果，不需要其他说明，确保返回结果能被Python的json.loads()解析，不需要返回markdown代码块。
+
+            格式：
+            {{
+                "search": "从代码中逐字复制的片段",
+                "replace": "替换后的片段"
+            }}
+            """
+
+            try:
+                edit = self._parse_llm_response(call_llm(self.llm_config, prompt, ("search", "replace")))
+            except Exception:
+                continue
+            _, failed = apply_edits(modified, [edit])
+            if len(failed) == 0:
+                return edit
+
+        return None
+
+    def _set_revert_messages(self, results: List[List[Dict]]):
+        messages = self._generate_revert_messages([file_commits[0] for file_commits in results])
+        for file_commits, message in zip(results, messages):
+            file_commits[1]["commit_message"] = message
+
+    def _generate_revert_messages(self, add_commits: List[Dict]) -> List[str]:
+        changes = [
+            {"file_path": commit["file_path"], "commit_message": commit["commit_message"]}
+            for commit in add_commits
+        ]
+
+        prompt = f"""
+        下面是对若干文件的修改及其提交信息，现在需要逐个撤销这些修改。
+
+        修改列表:
+        {json.dumps(changes, indent=2, ensure_ascii=False)}
+
+        要求：
+        1. 按顺序为每个撤销操作编写一条提交信息，数量与修改列表一致
+        2. 精简的英文Git提交信息，不需要任何前缀
+        3. 尽量使用Update去描述，不要使用Delete/Remove/Revert描述
+
+        请直接以JSON格式返回结果，不需要其他说明，确保返回结果能被Python的json.loads()解析，不需要返回markdown代码块。
+
+        格式：
+        {{
+            "commit_messages": ["第一条提交信息", "第二条提交信息"]
+        }}
+        """
+
         try:
-            return json.loads(response)
-        except:
-            import re
-            json_match = re.search(r'```json\s*(\{.*?})\s*```', response, re.DOTALL)
-            if json_match:
-                return json.loads(json_match.group(1))
-
-            return {
-                "modified_code": response,
-                "commit_message": "自动生成的更改"
-            }
+            with profiler.span("revert_messages", "plan", files=len(add_commits)):
+                response = call_llm(self.llm_config, prompt, ("commit_messages",))
+            messages = self._parse_llm_response(response)["commit_messages"]
+            if len(messages) == len(add_commits) and all(isinstance(message, str) for message in messages):
+                return messages
+        except Exception:
+            pass
+
+        return [f"Update {os.path.basename(commit['file_path'])}" for commit in add_commits]
+
+    def _parse_llm_response(self, response: str) -> Dict:
+        result = parse_json(response)
+        if not isinstance(result, dict):
+            raise ValueError("LLM 响应不是 JSON 对象")
+        return result
@@ -3,10 +3,13 @@ import sys
 import time
 
 import git
+from call_llm import DEFAULT_MAX_RETRIES
+from codebase_analyzer import DEFAULT_MAX_FILE_SIZE
 from commit_mirage import CommitMirage
 from utils import print_err
 
-if __name__ == "__main__":
+
+def build_parser():
     parser = argparse.ArgumentParser(description="Commit Mirage")
     parser.add_argument("dir", help="Working dir.", default=".")
     parser.add_argument("-s", "--start", type=int, help="Start time for generated commits.")
@@ -16,9 +19,33 @@ if __name__ == "__main__":
     parser.add_argument("-p", "--provider", choices=["anthropic", "openai"], default="anthropic")
     parser.add_argument("-b", "--base-url", type=str)
     parser.add_argument("-a", "--api-key", type=str)
+    parser.add_argument("-m", "--model", type=str)
+    parser.add_argument("--max-tokens", type=int)
+    parser.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES)
     parser.add_argument("-d", "--debug", action="store_true")
-    args = parser.parse_args()
+    parser.add_argument("--backend", choices=["worktree", "fast-import"], default="worktree")
+    parser.add_argument("--git-ls-files", action="store_true")
+    parser.add_argument("--max-file-size", type=int, default=DEFAULT_MAX_FILE_SIZE)
+    parser.add_argument("--analysis-cache", action="store_true")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Concurrent LLM requests.")
+    parser.add_argument("--rate-limit", type=float, help="LLM requests per minute.")
+    parser.add_argument("--llm-cache", type=str, help="Directory for cached LLM responses.")
+    parser.add_argument("--llm-cache-bypass", action="store_true", help="Ignore cached LLM responses.")
+    parser.add_argument("--local-revert", action="store_true", help="Restore originals without asking the LLM.")
+    parser.add_argument("--edit-format", choices=["full", "edits"], default="full")
+    parser.add_argument("--stream", action="store_true", help="Stream LLM responses and validate them on the fly.")
+    parser.add_argument("--batch-tokens", type=int, default=0, help="Token budget for batching small files.")
+    parser.add_argument("--pipeline", action="store_true", help="Write commits while later LLM calls are running.")
+    parser.add_argument("--slice-lines", type=int, default=0, help="Send only one region of files above this size.")
+    parser.add_argument("--resume", action="store_true", help="Resume from the last saved run state.")
+    parser.add_argument("--plan-only", action="store_true", help="Stop after planning and print the plan file.")
+    parser.add_argument("--apply", type=str, default=None, help="Create commits from a saved plan file.")
+    parser.add_argument("--isolated", action="store_true", help="Commit in a temporary worktree on tmpfs.")
+    parser.add_argument("--profile", type=str, help="Write a Chrome trace and a .summary.json profile here.")
+    return parser
+
 
+def build_opts(args):
     opts = {
         "dir": args.dir,
         "debug": args.debug,
@@ -26,7 +53,29 @@ if __name__ == "__main__":
         "times": args.times,
         "provider": args.provider,
         "base_url": args.base_url,
-        "api_key": args.api_key
+        "api_key": args.api_key,
+        "model": args.model,
+        "max_tokens": args.max_tokens,
+        "max_retries": args.max_retries,
+        "backend": args.backend,
+        "git_ls_files": args.git_ls_files,
+        "max_file_size": args.max_file_size,
+        "analysis_cache": args.analysis_cache,
+        "jobs": args.jobs,
+        "rate_limit": args.rate_limit,
+        "llm_cache": args.llm_cache,
+        "llm_cache_bypass": args.llm_cache_bypass,
+        "local_revert": args.local_revert,
+        "edit_format": args.edit_format,
+        "stream": args.stream,
+        "batch_tokens": args.batch_tokens,
+        "slice_lines": args.slice_lines,
+        "pipeline": args.pipeline,
+        "resume": args.resume,
+        "plan_only": args.plan_only,
+        "apply": args.apply,
+        "isolated": args.isolated,
+        "profile": args.profile
     }
 
     if args.start is None:
@@ -50,9 +99,9 @@ if __name__ == "__main__":
         print_err("Generate times must be 2 or larger.")
         sys.exit(2)
 
-    if opts["times"] > 10:
-        print_err("Generate times must less or equal to 10.")
-        sys.exit(2)
+    return opts
+
 
-    generator = CommitMirage(opts)
+if __name__ == "__main__":
+    generator = CommitMirage(build_opts(build_parser().parse_args()))
     generator.run()
@@ -0,0 +1,36 @@
+from typing import Dict, List
+
+# 向 LLM 请求的修改对数量上限，提交数更多时循环复用这些修改
+MAX_POOL_SIZE = 20
+
+
+def required_pairs(times: int) -> int:
+    # 两个提交时一对修改即可；更多提交时相邻提交需要不同的修改，否则中间提交没有净改动
+    return 1 if times == 2 else 2
+
+
+def build_commit_plan(refactor_plan: List[Dict], times: int) -> List[List[Dict]]:
+    # refactor_plan 按 [添加0, 删除0, 添加1, 删除1, ...] 排列
+    # 操作序列为 添加u0, 删除u0, 添加u1, 删除u1, ...，每对修改都先添加再删除，因此每个文件最终恢复原样
+    # 前 times - 1 个提交都以一次添加结束，最后一个提交只包含最后一次删除
+    pairs = len(refactor_plan) // 2
+    if pairs < required_pairs(times):
+        raise Exception("可用的修改不足")
+
+    uses = max(pairs, times - 1)
+    final_plan = []
+    commit = []
+    u = 0
+    for i in range(times - 1):
+        # 第 i 个提交以第 k 次添加结束，k 严格递增且最后一个为 uses - 1
+        k = (i + 1) * uses // (times - 1) - 1
+        while u <= k:
+            if u > 0:
+                commit.append(refactor_plan[2 * ((u - 1) % pairs) + 1])
+            commit.append(refactor_plan[2 * (u % pairs)])
+            u += 1
+        final_plan.append(commit)
+        commit = []
+
+    final_plan.append([refactor_plan[2 * ((uses - 1) % pairs) + 1]])
+    return final_plan
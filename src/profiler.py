@@ -0,0 +1,132 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Any, Optional
+
+# 未启用时所有记录调用都直接返回这个共享的空上下文，几乎没有开销
+_NULL_SPAN = nullcontext()
+
+
+# 记录耗时区间和计数器，导出为 Chrome trace event 格式（可以在 chrome://tracing 或 Perfetto 中打开）
+class Profiler:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.pid = os.getpid()
+        self.events = []
+        self.counters = {}
+        self.threads = {}
+        self.llm_calls = []
+        self.lock = threading.Lock()
+
+    def _now(self) -> float:
+        # trace event 的时间单位是微秒
+        return (time.perf_counter() - self.started) * 1e6
+
+    @contextmanager
+    def span(self, name: str, category: str, args: Dict[str, Any]):
+        started = self._now()
+        try:
+            yield args
+        finally:
+            thread = threading.current_thread()
+            event = {"name": name, "cat": category, "ph": "X", "ts": started, "dur": self._now() - started,
+                     "pid": self.pid, "tid": thread.ident, "args": args}
+            with self.lock:
+                self.threads[thread.ident] = thread.name
+                self.events.append(event)
+
+    def count(self, name: str, value: float):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            self.events.append({"name": name, "ph": "C", "ts": self._now(), "pid": self.pid,
+                                "args": {name: self.counters[name]}})
+
+    def record_llm_call(self, stat: Dict[str, Any]):
+        with self.lock:
+            self.llm_calls.append(dict(stat))
+
+    def trace(self) -> Dict[str, Any]:
+        with self.lock:
+            metadata = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                        for tid, name in self.threads.items()]
+            return {"traceEvents": metadata + list(self.events), "displayTimeUnit": "ms"}
+
+    def summary(self) -> Dict[str, Any]:
+        with self.lock:
+            spans = {}
+            for event in self.events:
+                if event["ph"] != "X":
+                    continue
+                span = spans.setdefault(event["name"], {"category": event["cat"], "count": 0, "total": 0.0,
+                                                        "max": 0.0})
+                span["count"] += 1
+                span["total"] += event["dur"] / 1e6
+                span["max"] = max(span["max"], event["dur"] / 1e6)
+
+            llm_calls = list(self.llm_calls)
+            return {
+                "duration": time.perf_counter() - self.started,
+                "spans": spans,
+                "counters": dict(self.counters),
+                "llm": {
+                    "calls": len(llm_calls),
+                    "input_tokens": sum(call["input_tokens"] for call in llm_calls),
+                    "output_tokens": sum(call["output_tokens"] for call in llm_calls),
+                    "cache_read_tokens": sum(call["cache_read_tokens"] for call in llm_calls),
+                    "retries": sum(call["retries"] for call in llm_calls),
+                    "schema_retries": sum(call["schema_retries"] for call in llm_calls),
+                },
+                "llm_calls": llm_calls,
+            }
+
+
+_profiler = None
+
+
+def enable() -> Profiler:
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable():
+    global _profiler
+    _profiler = None
+
+
+def get_profiler() -> Optional[Profiler]:
+    return _profiler
+
+
+def span(name: str, category: str, **args):
+    if _profiler is None:
+        return _NULL_SPAN
+    return _profiler.span(name, category, args)
+
+
+def count(name: str, value: float = 1):
+    if _profiler is not None:
+        _profiler.count(name, value)
+
+
+def record_llm_call(stat: Dict[str, Any]):
+    if _profiler is not None:
+        _profiler.record_llm_call(stat)
+
+
+def summary_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".summary.json"
+
+
+def export(path: str, extra: Optional[Dict[str, Any]] = None):
+    # trace 写入 path，汇总写入同名的 .summary.json
+    if _profiler is None:
+        return
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(_profiler.trace(), f)
+    summary = _profiler.summary()
+    summary.update(extra or {})
+    with open(summary_path(path), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
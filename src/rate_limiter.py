@@ -0,0 +1,80 @@
+import multiprocessing
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# 批量模式下多个进程共享的令牌桶，状态保存在共享内存中
+class SharedTokenBucket(TokenBucket):
+    def __init__(self, rate: float, capacity: Optional[float] = None, context=multiprocessing):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = context.Value("d", self.capacity, lock=False)
+        self._updated = context.Value("d", time.monotonic(), lock=False)
+        self.lock = context.Lock()
+
+    @property
+    def tokens(self) -> float:
+        return self._tokens.value
+
+    @tokens.setter
+    def tokens(self, value: float):
+        self._tokens.value = value
+
+    @property
+    def updated(self) -> float:
+        return self._updated.value
+
+    @updated.setter
+    def updated(self, value: float):
+        self._updated.value = value
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_shared_bucket = None
+_shared_semaphore = None
+
+
+def set_shared_limits(semaphore, bucket: Optional[TokenBucket]):
+    # 批量模式的工作进程启动时注入，所有 LLM 请求都经过同一个并发限制和令牌桶
+    global _shared_semaphore, _shared_bucket
+    _shared_semaphore = semaphore
+    _shared_bucket = bucket
+
+
+def get_concurrency_limiter():
+    return _shared_semaphore
+
+
+def get_rate_limiter(provider: str, requests_per_minute: Optional[float]) -> Optional[TokenBucket]:
+    # 每个 provider 共享一个令牌桶
+    if _shared_bucket is not None:
+        return _shared_bucket
+    if not requests_per_minute:
+        return None
+    with _limiters_lock:
+        if provider not in _limiters:
+            _limiters[provider] = TokenBucket(requests_per_minute / 60)
+        return _limiters[provider]
@@ -0,0 +1,115 @@
+import json
+import os
+import threading
+from typing import Dict, Any, List, Optional
+
+from utils import print_err
+
+STATE_VERSION = 2
+
+
+class RunState:
+    # 每个阶段完成后原子写入的运行状态，用于断点续跑和离线应用计划。
+    # 每个文件的生成结果追加到单独的日志中，不会因此重写整个状态文件
+    def __init__(self, path: str, key: Dict[str, Any]):
+        self.path = path
+        self.files_path = os.path.splitext(path)[0] + ".files.jsonl"
+        self.key = key
+        self.data = {"version": STATE_VERSION, "key": key}
+        self.files = {}
+        # 新的运行第一次写入前清掉上次遗留的文件日志
+        self.stale_files = True
+        self.lock = threading.Lock()
+
+    def load(self, check_key: bool = True) -> bool:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            print_err(f"运行状态已损坏，重新开始: {e}")
+            return False
+
+        if not isinstance(data, dict) or data.get("version") != STATE_VERSION:
+            print_err("运行状态格式不兼容，重新开始")
+            return False
+        if check_key and data.get("key") != self.key:
+            print_err("运行状态与当前仓库或参数不一致，重新开始")
+            return False
+
+        self.data = data
+        self.key = data.get("key")
+        self.files = self._load_files()
+        self.stale_files = False
+        return True
+
+    def _load_files(self) -> Dict[int, List[Dict]]:
+        files = {}
+        try:
+            with open(self.files_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    # 中断时最后一行可能没有写完，直接忽略
+                    try:
+                        entry = json.loads(line)
+                        files[int(entry["index"])] = entry["commits"]
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print_err(f"无法读取文件生成记录: {e}")
+        return files
+
+    def get(self, stage: str) -> Optional[Any]:
+        return self.data.get(stage)
+
+    def set(self, stage: str, value: Any):
+        with self.lock:
+            self.data[stage] = value
+            self._save()
+
+    def get_files(self) -> Dict[int, List[Dict]]:
+        with self.lock:
+            return dict(self.files)
+
+    def put_file(self, index: int, file_commits: List[Dict]):
+        # 可能在多个生成线程中调用，只追加一行，锁内的工作量与文件大小无关
+        line = json.dumps({"index": index, "commits": file_commits}, ensure_ascii=False) + "\n"
+        with self.lock:
+            self.files[index] = file_commits
+            self._clear_stale_files()
+            try:
+                with open(self.files_path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+            except OSError as e:
+                print_err(f"无法写入文件生成记录: {e}")
+
+    def _clear_stale_files(self):
+        if not self.stale_files:
+            return
+        self.stale_files = False
+        try:
+            os.remove(self.files_path)
+        except FileNotFoundError:
+            pass
+
+    def _save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._clear_stale_files()
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print_err(f"无法写入运行状态: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def remove(self):
+        for path in (self.path, self.files_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,69 @@
+import hashlib
+import os
+import tempfile
+
+import git
+
+
+def _rewrite_commit(data, parents):
+    # 只替换 parent 行，作者、提交者、提交信息和树保持不变；父提交改变后原签名失效，一并去掉
+    header, separator, message = data.partition(b"\n\n")
+    lines = []
+    written_parents = False
+    skipping_signature = False
+    for line in header.split(b"\n"):
+        if skipping_signature and line.startswith(b" "):
+            continue
+        skipping_signature = False
+        if line.startswith(b"parent "):
+            if not written_parents:
+                lines.extend(b"parent " + parent.encode("utf-8") for parent in parents)
+                written_parents = True
+            continue
+        if line.startswith((b"gpgsig ", b"gpgsig-sha256 ")):
+            skipping_signature = True
+            continue
+        lines.append(line)
+    return b"\n".join(lines) + separator + message
+
+
+def _commit_sha(data, algorithm):
+    return hashlib.new(algorithm, b"commit %d\0" % len(data) + data).hexdigest()
+
+
+# 把 base 之后的提交直接接到 new_base 上，不经过工作区。
+# 生成的提交最终内容与 base 一致，因此后代提交原有的树可以直接复用，只需重写父提交并重新计算哈希。
+# 要求 base 是 ref 的祖先，否则调用方需要改用 rebase
+def splice_history(base, new_base, ref, dir="."):
+    old_tip = git.rev_parse(ref, dir)
+    algorithm = "sha256" if len(base) == 64 else "sha1"
+    session = git.get_session(dir)
+
+    mapping = {base: new_base}
+    rewritten = []
+    for commit, parents in git.rev_list_parents(base, old_tip, dir):
+        new_parents = [mapping.get(parent, parent) for parent in parents]
+        if new_parents == parents:
+            continue
+        object_type, data = session.read(commit)
+        data = _rewrite_commit(data, new_parents)
+        mapping[commit] = _commit_sha(data, algorithm)
+        rewritten.append((mapping[commit], data))
+
+    # 一次 hash-object 调用写入所有新提交对象，最后只更新一次引用
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for sha, data in rewritten:
+            path = os.path.join(directory, sha)
+            with open(path, 'wb') as f:
+                f.write(data)
+            paths.append(path)
+        written = git.hash_objects("commit", paths, dir)
+    if written != [sha for sha, data in rewritten]:
+        raise Exception("写入的提交对象与计算的哈希不一致")
+
+    new_tip = mapping.get(old_tip, old_tip)
+    if new_tip == old_tip:
+        raise Exception(f"{base} 不是 {ref} 的祖先，无法拼接生成的提交")
+    git.update_ref(ref, new_tip, old_tip, dir)
+    return new_tip